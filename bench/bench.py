@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Benchmarks for blogen.
+#
+# Generates a synthetic blog and times the main build stages.  Results
+# are saved as JSON so they can be compared across commits:
+#
+#   bench/bench.py --posts 1000 --save before.json
+#   (apply changes)
+#   bench/bench.py --posts 1000 --compare before.json
+
+import sys
+import os
+import argparse
+import datetime
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import PIL.Image
+
+import blogenlib.config
+import blogenlib.source
+import blogenlib.markdown
+import blogenlib.template
+import blogenlib.renderer
+import blogenlib.builder
+
+WORDS = '''lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis
+nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat'''.split()
+
+class BlogGenerator:
+    """Generate a synthetic blog source tree"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.tags = [ 'tag{}'.format(i) for i in range(args.tags) ]
+        self.post_names = [ 'Post-{:05}'.format(i) for i in range(args.posts) ]
+
+    def sentence(self, min_words=5, max_words=15):
+        words = [ self.rnd.choice(WORDS) for _ in range(self.rnd.randint(min_words, max_words)) ]
+        return ' '.join(words).capitalize() + '.'
+
+    def paragraph(self):
+        return '\n'.join(self.sentence() for _ in range(self.rnd.randint(2, 5)))
+
+    def table(self):
+        lines = [ '| a | b | c |', '|---|:-:|--:|' ]
+        for i in range(self.rnd.randint(2, 8)):
+            lines.append('| {} | *{}* | `{}` |'.format(self.rnd.choice(WORDS), self.rnd.choice(WORDS), i))
+        return '\n'.join(lines)
+
+    def code_block(self):
+        lines = [ '```c example.c' ]
+        for i in range(self.rnd.randint(5, 30)):
+            lines.append('  int x{} = {} + y; // {}'.format(i, i * 3, self.rnd.choice(WORDS)))
+        lines.append('```')
+        return '\n'.join(lines)
+
+    def post_text(self, num, post_dir):
+        blocks = []
+        for i in range(self.args.paragraphs):
+            blocks.append(self.paragraph())
+            if i == 0:
+                for _ in range(self.args.links):
+                    blocks.append("See {{% post_link {} %}}.".format(self.rnd.choice(self.post_names)))
+        for _ in range(self.args.tables):
+            blocks.append(self.table())
+        for _ in range(self.args.code_blocks):
+            blocks.append(self.code_block())
+        for i in range(self.args.images):
+            image_name = 'image{}.png'.format(i)
+            self.write_image(os.path.join(post_dir, image_name), num + i)
+            blocks.append('![{}]({}/{})'.format(self.sentence(2, 4), os.path.basename(post_dir), image_name))
+        return '\n\n'.join(blocks) + '\n'
+
+    def write_image(self, filename, num):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        img = PIL.Image.new('RGB', (32 + num % 64, 32), (num % 256, 128, 64))
+        img.save(filename)
+
+    def write_post(self, posts_dir, num, name):
+        date = datetime.datetime(2010, 1, 1) + datetime.timedelta(hours=num * 7)
+        tags = self.rnd.sample(self.tags, min(len(self.tags), self.rnd.randint(1, self.args.tags_per_post)))
+        post_dir = os.path.join(posts_dir, name)
+        with open(post_dir + '.md', 'w') as f:
+            f.write('---\n')
+            f.write('title: {}\n'.format(self.sentence(2, 6)[:-1]))
+            f.write('date: {}\n'.format(date.strftime('%Y-%m-%d %H:%M:%S')))
+            f.write('tags:\n')
+            for tag in tags:
+                f.write('- {}\n'.format(tag))
+            f.write('---\n\n')
+            f.write(self.post_text(num, post_dir))
+
+    def generate(self, root):
+        source_dir = os.path.join(root, 'source')
+        posts_dir = os.path.join(source_dir, '_posts')
+        os.makedirs(posts_dir)
+        for num, name in enumerate(self.post_names):
+            self.write_post(posts_dir, num, name)
+        shutil.copytree(self.args.assets, os.path.join(root, 'assets'))
+        cfg_file = os.path.join(root, 'blogen.cfg')
+        with open(cfg_file, 'w') as f:
+            f.write('site_url      = http://localhost:8080/\n')
+            f.write('publish_url   = /bench\n')
+            f.write('blog_title    = Benchmark Blog\n')
+            f.write('blog_subtitle = Synthetic posts\n')
+            f.write('blog_author   = blogen\n')
+            f.write('source_dir    = {}\n'.format(source_dir))
+            f.write('assets_dir    = {}\n'.format(os.path.join(root, 'assets')))
+            f.write('publish_dir   = {}\n'.format(os.path.join(root, 'publish')))
+            f.write('build_archives = 1\n')
+            f.write('build_months   = 1\n')
+            f.write('build_tags     = 1\n')
+            f.write('build_atom     = 1\n')
+            f.write('posts_in_index_page   = 5\n')
+            f.write('posts_in_archive_page = 20\n')
+            f.write('posts_in_month_page   = 20\n')
+            f.write('posts_in_tag_page     = 20\n')
+            f.write('posts_in_atom_feed    = 10\n')
+        return cfg_file
+
+class BuildOptions:
+    """Stand-in for the command line options given to the builder"""
+
+    def __init__(self, force_rebuild):
+        self.verbose = False
+        self.force_rebuild = force_rebuild
+        self.manifest = None
+        self.manifest_delta = False
+        self.profile = False
+        self.profile_memory = False
+        self.shard = None
+        self.jobs = 1
+        self.archive = None
+        self.archive_delta = False
+        self.keep_blocks = False
+
+class Benchmark:
+
+    def __init__(self, cfg_file, repeat):
+        self.cfg_file = cfg_file
+        self.repeat = repeat
+        self.results = {}
+
+    def cfg(self):
+        return blogenlib.config.Config(self.cfg_file)
+
+    def run(self, name, func, setup=None):
+        times = []
+        for _ in range(self.repeat):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+        self.results[name] = {
+            'min':    min(times),
+            'median': statistics.median(times),
+        }
+        print('{:<20} {:>10.4f} {:>10.4f}'.format(name, min(times), statistics.median(times)))
+
+    def run_all(self):
+        cfg = self.cfg()
+        src = blogenlib.source.Source(cfg)
+        parser = blogenlib.markdown.Parser()
+        texts = [ page.get_text() for page in src.get_page_list() ]
+        docs = [ parser.parse(text) for text in texts ]
+        renderer = blogenlib.renderer.Renderer(cfg, src, blogenlib.builder.CopyFileList())
+        tpl = blogenlib.template.TemplateProcessor(os.path.join(cfg.snapshot().assets_dir, 'tpl'))
+        tpl_builder = blogenlib.builder.Builder(cfg, BuildOptions(False))
+        tpl_builder.src = src
+        for page, doc in zip(src.get_page_list(), docs):
+            page.set_html(renderer.render(doc))
+        post_vars = [ tpl_builder._get_post_vars(post) for post in src.get_post_list() ]
+        common_vars = tpl_builder._get_common_vars()
+
+        def build_templates(_):
+            for data in post_vars:
+                page_data = common_vars.copy()
+                page_data.update(data)
+                tpl.build('post', page_data)
+
+        def parse_texts(_):
+            # a new parser for each run, without the block cache (as in one-shot builds)
+            parser = blogenlib.markdown.Parser(False)
+            for text in texts:
+                parser.parse(text)
+
+        def render_docs(_):
+            renderer = blogenlib.renderer.Renderer(cfg, src, blogenlib.builder.CopyFileList(), cache_blocks=False)
+            for doc in docs:
+                renderer.render(doc)
+
+        def touch_post():
+            post = src.get_post_list()[len(src.get_post_list()) // 2]
+            os.utime(post.get_source_filename())
+
+        print('{:<20} {:>10} {:>10}'.format('benchmark', 'min (s)', 'median (s)'))
+        self.run('source_read',    lambda _: blogenlib.source.Source(cfg))
+        self.run('markdown_parse', parse_texts)
+        self.run('markdown_render', render_docs)
+        self.run('template_build', build_templates)
+        self.run('build_full',     lambda _: blogenlib.builder.Builder(self.cfg(), BuildOptions(True)).build())
+        self.run('build_incremental', lambda _: blogenlib.builder.Builder(self.cfg(), BuildOptions(False)).build(), setup=touch_post)
+        self.run('build_noop',     lambda _: blogenlib.builder.Builder(self.cfg(), BuildOptions(False)).build())
+        return self.results
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(results, filename):
+    with open(filename, 'r') as f:
+        old = json.load(f)
+    print()
+    print('compared to {} ({}):'.format(filename, old.get('commit', '')))
+    for name, res in results.items():
+        if name not in old['results']:
+            continue
+        old_time = old['results'][name]['min']
+        change = (res['min'] - old_time) / old_time * 100 if old_time else 0
+        print('{:<20} {:>10.4f} {:>10.4f} {:>+8.1f}%'.format(name, old_time, res['min'], change))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run blogen benchmarks on a synthetic blog.')
+    parser.add_argument('--posts', type=int, default=200, help="number of posts (default: 200)")
+    parser.add_argument('--tags', type=int, default=50, help="number of distinct tags (default: 50)")
+    parser.add_argument('--tags-per-post', type=int, default=5, help="maximum tags per post (default: 5)")
+    parser.add_argument('--paragraphs', type=int, default=8, help="paragraphs per post (default: 8)")
+    parser.add_argument('--images', type=int, default=1, help="images per post (default: 1)")
+    parser.add_argument('--tables', type=int, default=1, help="tables per post (default: 1)")
+    parser.add_argument('--code-blocks', type=int, default=2, help="code blocks per post (default: 2)")
+    parser.add_argument('--links', type=int, default=2, help="post_link commands per post (default: 2)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument('--repeat', type=int, default=3, help="times to run each benchmark (default: 3)")
+    parser.add_argument('--assets', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', 'assets'),
+                        help="assets directory to use (default: the example assets)")
+    parser.add_argument('--keep', metavar='DIR', help="generate the blog in DIR and keep it")
+    parser.add_argument('--save', metavar='FILE', help="save results as JSON to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="compare results with a previously saved FILE")
+    args = parser.parse_args()
+
+    if args.keep:
+        root = os.path.abspath(args.keep)
+        if os.path.exists(root):
+            print("ERROR: directory already exists: {}".format(root))
+            return 1
+        os.makedirs(root)
+    else:
+        root = tempfile.mkdtemp(prefix='blogen-bench-')
+    try:
+        print('-> generating {} posts in {}'.format(args.posts, root))
+        cfg_file = BlogGenerator(args).generate(root)
+        results = Benchmark(cfg_file, args.repeat).run_all()
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+
+    if args.save:
+        data = {
+            'commit':  get_commit(),
+            'params':  { k: v for k, v in vars(args).items() if k not in ('keep', 'save', 'compare', 'assets') },
+            'results': results,
+        }
+        with open(args.save, 'w') as f:
+            json.dump(data, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+sys.exit(main())
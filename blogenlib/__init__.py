@@ -9,3 +9,10 @@ def url_join(*parts):
     if (not ret.startswith('/')) and parts[0].startswith('/'):
         return '/' + ret
     return ret
+
+def escape_html(text):
+    """Escape text to be used in HTML content or attribute values"""
+    # chained replace() is faster than str.translate() for multi-char
+    # replacements, and returns quickly when there's nothing to replace
+    return (text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('"', '&quot;').replace("'", '&apos;'))
@@ -0,0 +1,138 @@
+
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+# the earliest time a zip file can store
+DEFAULT_MTIME = 315532800
+
+def get_archive_mtime():
+    """Return the time set in all archive entries, so archives of the same files are identical
+
+    SOURCE_DATE_EPOCH is used if set (https://reproducible-builds.org/specs/source-date-epoch/).
+    """
+    try:
+        return max(int(os.environ['SOURCE_DATE_EPOCH']), DEFAULT_MTIME)
+    except (KeyError, ValueError):
+        return DEFAULT_MTIME
+
+def get_archive_format(filename):
+    """Return the archive format ('tar.gz', 'tar' or 'zip') for a filename"""
+    name = filename.lower()
+    if name.endswith('.tar.gz') or name.endswith('.tgz'):
+        return 'tar.gz'
+    if name.endswith('.tar'):
+        return 'tar'
+    if name.endswith('.zip'):
+        return 'zip'
+    raise ValueError('unknown archive format for "{}", must be .tar.gz, .tgz, .tar or .zip'.format(filename))
+
+class TarArchive:
+    """Write files to a tar archive, optionally compressed with gzip"""
+
+    def __init__(self, filename, compress, mtime):
+        self.mtime = mtime
+        self.f = open(filename, 'wb')
+        self.gz = None
+        if compress:
+            # the gzip header has a timestamp and a filename too
+            self.gz = gzip.GzipFile(filename='', mode='wb', fileobj=self.f, compresslevel=6, mtime=mtime)
+        self.tar = tarfile.open(fileobj=self.gz or self.f, mode='w', format=tarfile.PAX_FORMAT)
+
+    def _make_info(self, path, size):
+        info = tarfile.TarInfo(path)
+        info.size = size
+        info.mtime = self.mtime
+        info.mode = 0o644
+        return info
+
+    def add_data(self, path, data):
+        self.tar.addfile(self._make_info(path, len(data)), io.BytesIO(data))
+
+    def add_file(self, path, src_file):
+        with open(src_file, 'rb') as f:
+            self.tar.addfile(self._make_info(path, os.fstat(f.fileno()).st_size), f)
+
+    def close(self):
+        self.tar.close()
+        if self.gz:
+            self.gz.close()
+        self.f.close()
+
+class ZipArchive:
+    """Write files to a zip archive"""
+
+    def __init__(self, filename, mtime):
+        self.date_time = time.gmtime(mtime)[:6]
+        self.zip = zipfile.ZipFile(filename, 'w')
+
+    def _make_info(self, path):
+        info = zipfile.ZipInfo(path, date_time=self.date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        return info
+
+    def add_data(self, path, data):
+        self.zip.writestr(self._make_info(path), data)
+
+    def add_file(self, path, src_file):
+        with open(src_file, 'rb') as src, self.zip.open(self._make_info(path), 'w') as dst:
+            shutil.copyfileobj(src, dst)
+
+    def close(self):
+        self.zip.close()
+
+class ArchiveEntries:
+    """Stand-in for an archive that keeps the entries in memory
+
+    Worker processes use this to send the files they build to the main
+    process, which adds them to the real archive in order.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add_data(self, path, data):
+        self.entries.append((path, data))
+
+class SortedArchive:
+    """Archive that writes the entries sorted by path when closed
+
+    Files are built and copied in an order that depends on the order
+    the file system lists them, so the entries are sorted to make
+    archives of the same files identical.  Added files are only read
+    when the archive is closed.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.entries = {}
+
+    def add_data(self, path, data):
+        self.entries[path] = (data, None)
+
+    def add_file(self, path, src_file):
+        os.stat(src_file)  # raise OSError now if the file can't be archived
+        self.entries[path] = (None, src_file)
+
+    def close(self):
+        for path in sorted(self.entries):
+            (data, src_file) = self.entries[path]
+            if src_file is None:
+                self.archive.add_data(path, data)
+            else:
+                self.archive.add_file(path, src_file)
+        self.entries = {}
+        self.archive.close()
+
+def open_archive(filename):
+    """Open an archive for writing, in the format given by the filename extension"""
+    fmt = get_archive_format(filename)
+    mtime = get_archive_mtime()
+    if fmt == 'zip':
+        return SortedArchive(ZipArchive(filename, mtime))
+    return SortedArchive(TarArchive(filename, fmt == 'tar.gz', mtime))
@@ -3,33 +3,101 @@ import collections
 import sys
 import os
 import shutil
-import urllib.parse
 import pathlib
+import posixpath
 import datetime
 import re
+import hashlib
+import functools
+import io
+import multiprocessing
+import json
+import zlib
 
 import blogenlib
 import blogenlib.source
 import blogenlib.markdown
 import blogenlib.template
 import blogenlib.renderer
+import blogenlib.minify
+import blogenlib.manifest
+import blogenlib.profiler
+import blogenlib.cache
+import blogenlib.search
+import blogenlib.feeds
+import blogenlib.events
+import blogenlib.archive
+
+# builder and jobs used by output workers (see Builder._run_jobs_in_workers)
+_worker_builder = None
+_worker_jobs = None
+
+def _run_output_job(index):
+    return _worker_builder._run_job_in_worker(_worker_jobs[index])
+
+def remove_output_file(filename):
+    """Remove an output file before writing it
+
+    Writing over the file would change it in other places it's hard
+    linked to, like the previous release of a staged build (see
+    blogenlib.release).
+    """
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
 
 CopyFile = collections.namedtuple('CopyFile', 'src dest')
 
+PostList = collections.namedtuple('PostList', 'post_list tpl_name num_posts_in_page page_filenames extra_vars')
+
+PlannedOutput = collections.namedtuple('PlannedOutput', 'action file reason')
+
+BuildPlan = collections.namedtuple('BuildPlan', 'outputs num_unchanged')
+
+command_re = re.compile(r'\{%(.*?)%\}', re.DOTALL)
+
+def get_shard(path, num_shards):
+    """Return the shard (from 0 to num_shards-1) that builds an output file.
+
+    The path is relative to the publish dir.  Files in the same
+    directory as an index.html (like post images) go to the same shard
+    as the index.html.
+    """
+    (dirname, basename) = posixpath.split(path)
+    if basename == 'index.html' or not (basename.endswith('.html') or basename.endswith('.xml')):
+        key = dirname
+    else:
+        key = path
+    return zlib.crc32(key.encode('utf-8')) % num_shards
+
+def parse_shard(text):
+    """Parse a shard spec 'i/N' (with i from 1 to N) to (i-1, N)"""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if not match:
+        raise ValueError('invalid shard "{}", must be in the form i/N'.format(text))
+    (index, count) = (int(match.group(1)), int(match.group(2)))
+    if not (1 <= index <= count):
+        raise ValueError('invalid shard "{}", i must be between 1 and N'.format(text))
+    return (index - 1, count)
+
 class CopyFileList:
     """List of files to be copied for the build"""
 
     def __init__(self):
-        self.files = []
+        self.files = {}
 
     def get_num_files(self):
         return len(self.files)
 
+    def clear(self):
+        self.files = {}
+
     def get_list(self):
-        return self.files
+        return list(self.files.values())
 
     def add(self, src_file, dest_file):
-        self.files.append(CopyFile(src=src_file, dest=dest_file))
+        self.files[dest_file] = CopyFile(src=src_file, dest=dest_file)
 
     def is_source_newer(self, src, dest):
         src_path = pathlib.Path(src)
@@ -42,58 +110,163 @@ class CopyFileList:
             return True
         return False
 
-    def copy(self, force=False, verbose=False):
+    def get_copy_reason(self, copy_file, force=False):
+        """Return why a file must be copied, or None if the copy is up to date"""
+        if force:
+            return 'forced rebuild'
+        if not os.path.exists(copy_file.dest):
+            return 'output missing'
+        if self.is_source_newer(src=copy_file.src, dest=copy_file.dest):
+            return 'source changed'
+        return None
+
+    def copy(self, force=False, verbose=False, manifest=None, select=None, events=None, on_copy=None):
+        """Copy the files that are not up to date, calling on_copy(copy_file) for each one copied"""
         num_copied = 0
-        for copy_file in self.files:
-            if force or self.is_source_newer(src=copy_file.src, dest=copy_file.dest):
+        missing = []
+        for copy_file in self.get_list():
+            if select and not select(copy_file.dest):
+                continue
+            if self.get_copy_reason(copy_file, force) is not None:
                 if verbose:
                     print('   -> copying {}'.format(copy_file.src))
                 os.makedirs(os.path.dirname(copy_file.dest), exist_ok=True)
                 try:
+                    remove_output_file(copy_file.dest)
                     shutil.copyfile(copy_file.src, copy_file.dest)
                     num_copied += 1
+                    if manifest:
+                        manifest.add_file(copy_file.dest)
+                    if events:
+                        events.emit('copy_file', src=copy_file.src, file=copy_file.dest)
+                    if on_copy:
+                        on_copy(copy_file)
                 except FileNotFoundError:
                     print("* WARNING: error copying '{}': file not found".format(copy_file.src))
+                    missing.append(copy_file.dest)
                 except:
                     print("* WARNING: error copying '{}' to '{}': {}".format(copy_file.src, copy_file.dest, sys.exc_info()[0]))
+            elif manifest:
+                manifest.keep(copy_file.dest)
+        for dest in missing:
+            del self.files[dest]
         return num_copied
 
 class Builder:
 
-    def __init__(self, cfg, opts):
+    def __init__(self, cfg, opts, shared=None):
         self.cfg = cfg
+        self.conf = cfg.snapshot()
         self.opts = opts
+        # staged builds go to a new dir for each release, but keep the
+        # manifest of the publish dir given in the config
+        self.site_publish_dir = self.conf.publish_dir
+        self.shared = shared or blogenlib.cache.SharedCaches()
         self.copy_files = CopyFileList()
-        self.extra_pages = {}
         self.common_vars = None
+        self.common_vars_hash = None
         self.extra_vars = {}
+        self.asset_urls = {}
+        self.force_pages = opts.force_rebuild
+        self.force_reason = 'forced rebuild' if opts.force_rebuild else None
+        self.post_list_changed = False
+        self.planned = None
+        self.manifest = None
+        # with an archive, output files go to the archive, and also to
+        # the publish dir when only the changes are archived
+        self.archive = None
+        self.archive_only = bool(opts.archive) and not opts.archive_delta
+        self.profiler = blogenlib.profiler.Profiler(opts.profile, opts.profile_memory)
+        self.events = blogenlib.events.Events()
+        self.log_lines = None
+        self.src = None
+        self.tpl = None
+        self.post_index = None
+        self.post_index_changed = False
+        self.rerendered_pages = set()
+        self.stale_image_pages = set()
+        self.templates_changed = False
+        self.shard = parse_shard(opts.shard) if opts.shard else None
+        self.build_cache = None
+        if self.conf.cache_dir:
+            self.build_cache = blogenlib.cache.BuildCache(blogenlib.cache.DirectoryStorage(self.conf.cache_dir))
+        self.post_index_hash = None
+        self.search_terms = None
+        self.related_changed = set()
+        self.siblings_changed = set()
+        self.page_links = {}
+        self.links_changed = set()
+        self.post_list_items = {}
         self.month_names = [
             'January', 'Ferbuary', 'March', 'April', 'May', 'June',
             'July', 'August', 'September', 'October', 'November', 'December'
         ]
 
     def log(self, msg):
-        if self.opts.verbose:
+        if not self.opts.verbose:
+            return
+        if self.log_lines is not None:
+            self.log_lines.append(msg)
+        else:
             print(msg)
     
-    def get_tpl_file(self, tpl_name):
-        return os.path.join(self.cfg.v.assets_dir, 'tpl', tpl_name + '.tpl')
-
     def get_publish_file(self, filename):
-        return os.path.join(self.cfg.v.publish_dir, filename)
+        return os.path.join(self.conf.publish_dir, filename)
         
     def get_publish_url(self, *parts):
-        return blogenlib.url_join(self.cfg.v.publish_url, *parts)
+        return blogenlib.url_join(self.conf.publish_url, *parts)
+
+    def get_asset_url(self, name):
+        if name in self.asset_urls:
+            return self.asset_urls[name]
+        return self.get_publish_url(name)
      
+    def get_manifest_name(self, shard=None):
+        if shard is None:
+            return '.blogen-manifest.json'
+        return '.blogen-manifest.{}-of-{}.json'.format(shard[0] + 1, shard[1])
+
+    def get_manifest_dir(self):
+        """Return the dir of the build manifests
+
+        With cache_dir they're kept there (under a dir for each publish
+        dir), so they're not deployed with the blog.
+        """
+        if not self.conf.cache_dir:
+            return self.conf.publish_dir
+        return os.path.join(self.conf.cache_dir, 'manifest', blogenlib.cache.make_key(self.site_publish_dir)[:16])
+
+    def _open_manifest(self, shard=None):
+        return blogenlib.manifest.BuildManifest(self.conf.publish_dir, self.get_manifest_name(shard), self.get_manifest_dir())
+
+    def in_shard(self, filename):
+        """Check if a file in the publish dir is built by the current shard"""
+        if self.shard is None:
+            return True
+        path = os.path.relpath(filename, self.conf.publish_dir).replace(os.sep, '/')
+        return get_shard(path, self.shard[1]) == self.shard[0]
+
     def datetime_to_iso(self, dt):
-        return '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}.000'.format(int(dt.year), int(dt.month), int(dt.day), int(dt.hour), int(dt.minute), int(dt.second));
+        return '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}.000{}'.format(int(dt.year), int(dt.month), int(dt.day), int(dt.hour), int(dt.minute), int(dt.second),
+                                                                 self.get_utc_offset(dt))
+
+    def get_utc_offset(self, dt):
+        """Get the offset of the local time zone at a post date, like '-03:00'"""
+        # feeds need dates with an offset, and post dates are in local time
+        try:
+            local = datetime.datetime(int(dt.year), int(dt.month), int(dt.day), int(dt.hour), int(dt.minute), int(dt.second)).astimezone()
+        except (ValueError, OverflowError, OSError):
+            return '+00:00'
+        offset = local.strftime('%z')
+        return offset[:3] + ':' + offset[3:5]
+
+    def date_to_iso(self, dt):
+        return '{:04}-{:02}-{:02}'.format(int(dt.year), int(dt.month), int(dt.day))
+
+    def get_site_url(self, url):
+        """Get the absolute URL of a publish URL"""
+        return blogenlib.url_join(self.conf.site_url, url)
 
-    def get_dest_file_mtime(self, filename):
-        path = pathlib.Path(filename)
-        if not path.exists():
-            return 0
-        return path.stat().st_mtime
-    
     def _get_common_vars(self):
         if self.common_vars:
             ret = self.common_vars.copy()
@@ -102,15 +275,18 @@ class Builder:
         
         self.common_vars = {
             'blog_url':         self.get_publish_url('/'),
-            'favicon_url':      self.get_publish_url('/favicon.png'),
-            'css_url':          self.get_publish_url('/css/style.css'),
-            'blog_title':       self.cfg.v.blog_title,
-            'blog_subtitle':    self.cfg.v.blog_subtitle,
-            'blog_author':      self.cfg.v.blog_author,
+            'favicon_url':      self.get_asset_url('favicon.png'),
+            'css_url':          self.get_asset_url('css/style.css'),
+            'blog_title':       self.conf.blog_title,
+            'blog_subtitle':    self.conf.blog_subtitle,
+            'blog_author':      self.conf.blog_author,
             'blog_year':        str(datetime.datetime.now().year),
             'tag':              [],
             'month':            [],
         }
+        for name, url in self.asset_urls.items():
+            var_name = 'asset_' + re.sub(r'[^a-z0-9]+', '_', name.lower()) + '_url'
+            self.common_vars[var_name] = url
         for tag in self.src.get_tag_list():
             self.common_vars['tag'].append({
                 'tag_name': tag,
@@ -125,14 +301,17 @@ class Builder:
             })
         return self._get_common_vars()
 
-    def _get_post_vars(self, post):
+    def _get_post_vars(self, post, need_content=True):
         data = {
             'post_url':      post.get_publish_url(),
             'post_title':    post.get_title(),
             'post_date':     post.get_date(),
-            'post_content':  post.get_html(),
+            'post_excerpt':  self.get_page_excerpt(post),
+            'post_has_more': '1' if post.has_excerpt() else '',
             'post_tag':      []
         }
+        if need_content:
+            data['post_content'] = self.get_page_html(post)
         for tag in post.get_tags():
             data['post_tag'].append({
                 'post_tag_url':  self.get_publish_url('tags', tag),
@@ -140,28 +319,106 @@ class Builder:
             })
         return data
     
+    def _build_html(self, tpl_name, data):
+        with self.events.span('template', template=tpl_name):
+            content = self.tpl.build(tpl_name, data)
+        if self.conf.minify_html:
+            content = blogenlib.minify.minify_html(content)
+        return content
+
     def _write_file(self, filename, content):
+        self._write_file_data(filename, content.encode('utf-8'))
+
+    def _write_file_data(self, filename, data):
+        self.log('   -> writing {}'.format(filename))
+        if self.archive is not None:
+            self.archive.add_data(self.manifest.get_path(filename), data)
+        if not self.archive_only:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            remove_output_file(filename)
+            with open(filename, 'wb') as f:
+                f.write(data)
+        self.manifest.add_data(filename, data)
+        self.num_files_written += 1
+        self.events.emit('write_file', file=filename, size=len(data))
+
+    def _write_file_stream(self, filename, write_content):
+        """Write a file with write_content(out), where out is a text file-like object"""
+        if self.archive is not None:
+            # archive entries need the size before the data
+            out = blogenlib.manifest.HashingWriter(io.BytesIO())
+            write_content(out)
+            self._write_file_data(filename, out.f.getvalue())
+            return
         self.log('   -> writing {}'.format(filename))
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, 'w') as f:
-            f.write(content)
+        remove_output_file(filename)
+        with open(filename, 'wb') as f:
+            out = blogenlib.manifest.HashingWriter(f)
+            write_content(out)
+        self.manifest.add_hash(filename, out.get_hash(), out.size)
         self.num_files_written += 1
+        self.events.emit('write_file', file=filename, size=out.size)
             
-    def _build_single_page(self, page, tpl_name, filename):
-        if ((not self.opts.force_rebuild) and (not page.needs_update())):
-            return
+    def _plan_output(self, action, filename, reason):
+        """When planning a build, record an output instead of producing it (returns True)"""
+        if self.planned is None:
+            return False
+        self.planned.append(PlannedOutput(action=action, file=self.manifest.get_path(filename), reason=reason))
+        return True
+
+    def _get_page_reason(self, page, filename):
+        """Return why the output of a page must be written, or None if it's up to date"""
+        if self.force_pages:
+            return self.force_reason
+        if page.needs_update():
+            return 'source changed' if os.path.exists(filename) else 'output missing'
+        if page in self.rerendered_pages:
+            return 'rendered again'
+        if page in self.links_changed:
+            return 'linked posts changed'
+        return None
+
+    def _make_single_page(self, page, tpl_name):
         data = self._get_common_vars()
         data.update({
             'page_title':   page.get_title(),
             'page_date':    page.get_date(),
-            'page_content': page.get_html(),
+            'page_content': self.get_page_html(page),
         })
-        content = self.tpl.build(tpl_name, data)
+        return self._build_html(tpl_name, data)
+
+    def _build_single_page(self, page, tpl_name, filename):
+        if not self.in_shard(filename):
+            return
+        reason = self._get_page_reason(page, filename)
+        if reason is None:
+            self.manifest.keep(filename)
+            return
+        if self._plan_output('write', filename, reason):
+            return
+        content = self._make_single_page(page, tpl_name)
         self._write_file(filename, content)
         
     def _build_post_page(self, post):
-        if ((not self.opts.force_rebuild) and (not post.needs_update())):
+        filename = os.path.join(post.get_publish_dir(), 'index.html')
+        if not self.in_shard(filename):
+            return
+        reason = self._get_page_reason(post, filename)
+        if (reason is None) and (post.siblings_changed or (post.get_name() in self.siblings_changed)):
+            reason = 'older or newer post changed'
+        if (reason is None) and (post.get_name() in self.related_changed):
+            reason = 'related posts changed'
+        if reason is None:
+            self.manifest.keep(filename)
+            return
+        if self._plan_output('write', filename, reason):
             return
+        with self.profiler.item('write', post.get_source_filename()):
+            content = self._make_post_page(post)
+            self._write_file(filename, content)
+
+    def _make_post_page(self, post):
         older_post = post.get_older_post()
         newer_post = post.get_newer_post()
         data = self._get_common_vars()
@@ -172,13 +429,17 @@ class Builder:
             'newer_post_url':   newer_post.get_publish_url() if newer_post else '',
             'newer_post_title': newer_post.get_title() if newer_post else '',
         })
+        post_data['related_post'] = []
+        for related in self.src.get_related_posts(post):
+            post_data['related_post'].append({
+                'related_post_url':   related.get_publish_url(),
+                'related_post_title': related.get_title(),
+                'related_post_date':  related.get_date(),
+            })
         data.update(post_data)
+        return self._build_html('post', data)
 
-        content = self.tpl.build('post', data)
-        filename = os.path.join(post.get_publish_dir(), 'index.html')
-        self._write_file(filename, content)
-
-    def _build_post_list_page(self, post_list, tpl_name, filename, page_nav, extra_vars=None):
+    def _make_post_list_page(self, post_list, tpl_name, page_nav, extra_vars=None):
         data = self._get_common_vars()
         data.update({
             'prev_page_url': page_nav['prev_url'],
@@ -189,20 +450,32 @@ class Builder:
         })
         if extra_vars:
             data.update(extra_vars)
+        # don't render full posts if the template only needs excerpts
+        need_content = self.tpl.uses_var(tpl_name, 'post_content')
         for post in post_list:
-            data['post'].append(self._get_post_vars(post))
-        
-        content = self.tpl.build(tpl_name, data)
-        self._write_file(filename, content)
+            data['post'].append(self._get_post_list_item(post, need_content))
+        return self._build_html(tpl_name, data)
 
-    def _build_post_list(self, post_list, tpl_name, num_posts_in_page, page_filenames, extra_vars=None):
-        if ((not self.opts.force_rebuild) and
-            (self.src.get_last_post_mtime() < self.get_dest_file_mtime(self.get_publish_file(page_filenames['first'])))):
-            return
+    def _get_post_list_item(self, post, need_content):
+        # the same post appears in many list pages, so the output of
+        # its entry is cached by the template processor; the key is made
+        # from what the vars depend on, so the post is only rendered when
+        # its entry is not in the cache
+        key = (post, need_content)
+        if key not in self.post_list_items:
+            item_key = blogenlib.cache.make_key(json.dumps([
+                post.get_publish_url(), post.get_source_hash(), post.get_tags(), need_content,
+                self.conf.publish_url, self._get_page_html_hash(post),
+            ]))
+            self.post_list_items[key] = blogenlib.template.CachedItem(item_key, functools.partial(self._get_post_vars, post, need_content))
+        return self.post_list_items[key]
+
+    def _get_post_list_pages(self, post_list, num_posts_in_page, page_filenames):
+        """Split a post list in pages, yielding (filename, posts, page_nav) for each page"""
         num_pages = len(post_list) // num_posts_in_page
         if len(post_list) % num_posts_in_page != 0:
             num_pages += 1
-            
+
         prev_page_url = ''
         cur_page_url = self.get_publish_url(page_filenames['first'])
         cur_page = 0
@@ -217,123 +490,1041 @@ class Builder:
                 'next_url':  next_page_url if (cur_page+1)*num_posts_in_page < len(post_list) else ''
             }
             out_file = page_filenames['first'] if cur_page == 0 else page_filenames['rest'].format(cur_page+1)
-            self._build_post_list_page(post_list[first_post:end_post], tpl_name, self.get_publish_file(out_file), page_nav, extra_vars=extra_vars)
+            yield (out_file, post_list[first_post:end_post], page_nav)
             prev_page_url = cur_page_url
             cur_page_url = next_page_url
             cur_page += 1
 
-    def _build_tag_pages(self):
-        for tag in self.src.get_tag_list():
-            page_filenames = {
-                'first': blogenlib.url_join('tags', tag, 'index.html'),
-                'rest':  blogenlib.url_join('tags', tag, 'page{}.html'),
-            }
-            data = {
-                'tag_name': tag
-            }
-            post_list = sorted(self.src.get_tag_posts(tag), reverse=True, key=lambda post: post.get_date())
-            self._build_post_list(post_list, 'tag', self.cfg.int('posts_in_tag_page', defval=5), page_filenames, extra_vars=data)
+    def _get_post_list_page_deps(self, plist, posts, page_nav):
+        # posts using post_link also depend on the linked posts
+        deps = [ self._get_common_vars_hash(), self.tpl.get_tpl_hash(plist.tpl_name), page_nav, plist.extra_vars ]
+        for post in posts:
+            deps.append([ post.get_publish_url(), post.get_source_hash(), self.page_links.get(post, None) ])
+        return deps
 
-    def _build_month_pages(self):
-        for month in self.src.get_month_list():
-            (y, m) = month.split('-')
-            month_name = '{} {}'.format(self.month_names[int(m)-1], y)
-            page_filenames = {
-                'first': blogenlib.url_join('archives', month.replace('-', '/'), 'index.html'),
-                'rest':  blogenlib.url_join('archives', month.replace('-', '/'), 'page{}.html'),
-            }
-            data = {
-                'month_name': month_name
-            }
-            post_list = sorted(self.src.get_month_posts(month), reverse=True, key=lambda post: post.get_date())
-            self._build_post_list(post_list, 'month', self.cfg.int('posts_in_month_page', defval=5), page_filenames, extra_vars=data)
+    def _get_common_vars_hash(self):
+        if self.common_vars_hash is None:
+            self.common_vars_hash = blogenlib.cache.make_key(json.dumps(self._get_common_vars(), sort_keys=True))
+        return self.common_vars_hash
 
-    def _build_atom_feed(self):
-        filename = self.get_publish_file('atom.xml')
-        if ((not self.opts.force_rebuild) and
-            (self.src.get_last_post_mtime() < self.get_dest_file_mtime(filename))):
+    def _get_post_list_reason(self, filename, deps_hash):
+        """Return why a page of a post list must be written, or None if it's up to date"""
+        if self.force_pages:
+            return self.force_reason
+        if self.post_list_changed:
+            return 'list of posts changed'
+        if self.manifest.get_old_deps(filename) != deps_hash:
+            return 'posts changed'
+        if not os.path.isfile(filename):
+            return 'output missing'
+        return None
+
+    def _build_post_list(self, plist):
+        pages = self._get_post_list_pages(plist.post_list, plist.num_posts_in_page, plist.page_filenames)
+        for out_file, posts, page_nav in pages:
+            filename = self.get_publish_file(out_file)
+            if not self.in_shard(filename):
+                continue
+            # the posts in each page are checked against the manifest
+            # (and not the output files, which other shards may write)
+            deps_hash = blogenlib.cache.make_key(json.dumps(self._get_post_list_page_deps(plist, posts, page_nav)))
+            self.manifest.set_deps(filename, deps_hash)
+            reason = self._get_post_list_reason(filename, deps_hash)
+            if reason is None:
+                self.manifest.keep(filename)
+                continue
+            if self._plan_output('write', filename, reason):
+                continue
+            content = self._make_post_list_page(posts, plist.tpl_name, page_nav, extra_vars=plist.extra_vars)
+            self._write_file(filename, content)
+
+    def _get_index_post_list(self):
+        return PostList(post_list=self.src.get_post_list(), tpl_name='index',
+                        num_posts_in_page=self.conf.posts_in_index_page,
+                        page_filenames={ 'first' : 'index.html', 'rest': 'page{}.html' },
+                        extra_vars=None)
+
+    def _get_archive_post_list(self):
+        return PostList(post_list=self.src.get_post_list(), tpl_name='archives',
+                        num_posts_in_page=self.conf.posts_in_archive_page,
+                        page_filenames={ 'first' : 'archives/index.html', 'rest': 'archives/page{}.html' },
+                        extra_vars=None)
+
+    def _get_tag_post_list(self, tag):
+        page_filenames = {
+            'first': blogenlib.url_join('tags', tag, 'index.html'),
+            'rest':  blogenlib.url_join('tags', tag, 'page{}.html'),
+        }
+        data = {
+            'tag_name': tag
+        }
+        post_list = sorted(self.src.get_tag_posts(tag), reverse=True, key=lambda post: post.get_sort_key())
+        return PostList(post_list=post_list, tpl_name='tag',
+                        num_posts_in_page=self.conf.posts_in_tag_page,
+                        page_filenames=page_filenames, extra_vars=data)
+
+    def _get_month_post_list(self, month):
+        (y, m) = month.split('-')
+        month_name = '{} {}'.format(self.month_names[int(m)-1], y)
+        page_filenames = {
+            'first': blogenlib.url_join('archives', month.replace('-', '/'), 'index.html'),
+            'rest':  blogenlib.url_join('archives', month.replace('-', '/'), 'page{}.html'),
+        }
+        data = {
+            'month_name': month_name
+        }
+        post_list = sorted(self.src.get_month_posts(month), reverse=True, key=lambda post: post.get_sort_key())
+        return PostList(post_list=post_list, tpl_name='month',
+                        num_posts_in_page=self.conf.posts_in_month_page,
+                        page_filenames=page_filenames, extra_vars=data)
+
+    def _get_feed_posts(self):
+        post_list = self.src.get_post_list()
+        return post_list[0:min(len(post_list), self.conf.posts_in_atom_feed)]
+
+    def _get_feed_deps(self, tpl_name, posts):
+        # feeds only need to be written again when the blog info or
+        # the posts in them change
+        deps = [
+            self.conf.site_url, self.conf.publish_url,
+            self.conf.blog_title, self.conf.blog_subtitle, self.conf.blog_author,
+            self.tpl.get_tpl_hash(tpl_name) if tpl_name else '',
+        ]
+        for post in posts:
+            deps.append([
+                post.get_publish_url(), post.get_title(), self.datetime_to_iso(post.get_date_time()),
+                post.get_tags(), self._get_page_html_hash(post),
+            ])
+        return deps
+
+    def _build_streamed_file(self, filename, get_deps, write_content):
+        """Write a file with write_content(out) unless the result of get_deps() is unchanged since the last build"""
+        if not self.in_shard(filename):
+            return
+        deps_hash = blogenlib.cache.make_key(json.dumps(get_deps()))
+        self.manifest.set_deps(filename, deps_hash)
+        if self.force_pages:
+            reason = self.force_reason
+        elif self.manifest.get_old_deps(filename) != deps_hash:
+            reason = 'contents changed'
+        elif not os.path.isfile(filename):
+            reason = 'output missing'
+        else:
+            self.manifest.keep(filename)
+            return
+        if self._plan_output('write', filename, reason):
             return
+        self._write_file_stream(filename, write_content)
 
+    def _build_atom_feed(self):
+        posts = self._get_feed_posts()
+        self._build_streamed_file(self.get_publish_file('atom.xml'),
+                                  lambda: self._get_feed_deps('atom', posts),
+                                  lambda out: self._write_atom_feed(out, posts))
+
+    def _write_atom_feed(self, out, posts):
+        with self.events.span('template', template='atom'):
+            self.tpl.build_to('atom', self._get_atom_feed_vars(posts), out)
+
+    def _make_atom_feed(self):
+        return self.tpl.build('atom', self._get_atom_feed_vars(self._get_feed_posts()))
+
+    def _get_atom_feed_vars(self, posts):
         data = self._get_common_vars()
-        post_list = self.src.get_post_list()
         data.update({
-            'blog_url':         blogenlib.url_join(self.cfg.v.site_url, self.cfg.v.publish_url) + '/',
-            'atom_url':         blogenlib.url_join(self.cfg.v.site_url, self.cfg.v.publish_url, 'atom.xml'),
-            'last_update_time': self.datetime_to_iso(post_list[0].get_date_time()),
-            'post':             [],
+            'blog_url':         self.get_site_url(self.get_publish_url('/')) + '/',
+            'atom_url':         self.get_site_url(self.get_publish_url('atom.xml')),
+            'last_update_time': self.datetime_to_iso(posts[0].get_date_time()) if posts else '',
+            'post':             self._get_atom_feed_entries(posts),
         })
-        num_posts = min(len(post_list), int(self.cfg.v.posts_in_atom_feed))
-        for post in post_list[0:num_posts]:
-            data['post'].append({
-                'post_url':          blogenlib.url_join(self.cfg.v.site_url, self.cfg.v.publish_url, post.get_publish_url()) + '/',
+        return data
+
+    def _get_atom_feed_entries(self, posts):
+        # entries are generated while the feed is written, so the
+        # content of all posts is never kept in memory at once
+        for post in posts:
+            yield {
+                'post_url':          self.get_site_url(post.get_publish_url()) + '/',
                 'post_title':        post.get_title(),
                 'post_date':         post.get_date(),
                 'post_publish_time': self.datetime_to_iso(post.get_date_time()),
-                'post_content':      post.get_html(),
-            })
+                'post_content':      self.get_page_html(post),
+            }
+
+    def _get_json_feed_info(self):
+        return {
+            'title':         self.conf.blog_title,
+            'home_page_url': self.get_site_url(self.get_publish_url('/')) + '/',
+            'feed_url':      self.get_site_url(self.get_publish_url('feed.json')),
+            'description':   self.conf.blog_subtitle,
+            'authors':       [ { 'name': self.conf.blog_author } ],
+        }
+
+    def _get_json_feed_items(self, posts):
+        for post in posts:
+            url = self.get_site_url(post.get_publish_url()) + '/'
+            yield {
+                'id':             url,
+                'url':            url,
+                'title':          post.get_title(),
+                'content_html':   self.get_page_html(post),
+                'date_published': self.datetime_to_iso(post.get_date_time()),
+                'tags':           post.get_tags(),
+            }
+
+    def _write_json_feed(self, out, posts):
+        blogenlib.feeds.write_json_feed(out, self._get_json_feed_info(), self._get_json_feed_items(posts))
+
+    def _build_json_feed(self):
+        posts = self._get_feed_posts()
+        self._build_streamed_file(self.get_publish_file('feed.json'),
+                                  lambda: self._get_feed_deps(None, posts),
+                                  lambda out: self._write_json_feed(out, posts))
+
+    def _make_json_feed(self):
+        out = io.StringIO()
+        self._write_json_feed(out, self._get_feed_posts())
+        return out.getvalue()
+
+    def _get_sitemap_urls(self):
+        """Return the list of (url, lastmod) of the pages in the sitemap"""
+        def list_entry(url, posts):
+            if not posts:
+                return (self.get_site_url(url) + '/', '')
+            last_post = max(posts, key=lambda post: post.get_sort_key())
+            return (self.get_site_url(url) + '/', self.date_to_iso(last_post.get_date_time()))
+
+        # posts come first, oldest first, so a new post only changes
+        # the last sitemap files when the sitemap is split
+        post_list = self.src.get_post_list()
+        urls = []
+        for post in reversed(post_list):
+            urls.append((self.get_site_url(post.get_publish_url()) + '/', self.date_to_iso(post.get_date_time())))
+        for page in self.src.get_single_page_list():
+            urls.append((self.get_site_url(page.get_publish_url()) + '/', self.date_to_iso(page.get_date_time())))
+        urls.append(list_entry(self.get_publish_url('/'), post_list))
+        if self.conf.build_archives:
+            urls.append(list_entry(self.get_publish_url('archives'), post_list))
+        if self.conf.build_months:
+            for month in self.src.get_month_list():
+                urls.append(list_entry(self.get_publish_url('archives', month.replace('-', '/')), self.src.get_month_posts(month)))
+        if self.conf.build_tags:
+            for tag in self.src.get_tag_list():
+                urls.append(list_entry(self.get_publish_url('tags', tag), self.src.get_tag_posts(tag)))
+        return urls
+
+    def _get_sitemap_files(self):
+        """Return a list of (name, entries, write function) of the sitemap files"""
+        max_urls = self.conf.sitemap_max_urls
+        parts = blogenlib.feeds.split_urls(self._get_sitemap_urls(), max_urls)
+        if len(parts) == 1:
+            return [ ('sitemap.xml', parts[0], blogenlib.feeds.write_sitemap) ]
+        ret = []
+        sitemaps = []
+        for num, part in enumerate(parts, 1):
+            name = 'sitemap-{}.xml'.format(num)
+            ret.append((name, part, blogenlib.feeds.write_sitemap))
+            sitemaps.append((self.get_site_url(self.get_publish_url(name)), max(lastmod for url, lastmod in part)))
+        ret.append(('sitemap.xml', sitemaps, blogenlib.feeds.write_sitemap_index))
+        return ret
+
+    def _build_sitemap(self):
+        for name, entries, write_sitemap in self._get_sitemap_files():
+            self._build_streamed_file(self.get_publish_file(name),
+                                      lambda: entries,
+                                      lambda out: write_sitemap(out, entries))
+
+    def _make_sitemap(self, name):
+        for sitemap_name, entries, write_sitemap in self._get_sitemap_files():
+            if sitemap_name == name:
+                out = io.StringIO()
+                write_sitemap(out, entries)
+                return out.getvalue()
+        return None
+
+    def _get_search_state_file(self, shard=None):
+        # the terms of the posts are kept in the cache dir, since in the
+        # publish dir they would be published
+        if not self.conf.cache_dir:
+            return None
+        if shard is None:
+            name = 'terms.json'
+        else:
+            name = 'terms.{}-of-{}.json'.format(shard[0] + 1, shard[1])
+        return os.path.join(self.conf.cache_dir, 'search', name)
+
+    def _build_search_index(self):
+        # without a state file, the terms of the last build of this
+        # builder (in watch mode) are used
+        index = blogenlib.search.SearchIndex(self._get_search_state_file(self.shard),
+                                             old_terms=self.search_terms if self.shard is None else None,
+                                             post_index_hash=self.post_index_hash)
+        if self.shard is not None:
+            # each shard finds the terms of its posts, and merge-shards
+            # writes the search files
+            if self.planned is not None:
+                return
+            for post in self.src.get_post_list():
+                if self.in_shard(os.path.join(post.get_publish_dir(), 'index.html')):
+                    index.add_post(post, self.get_page_html)
+            index.write_state()
+            return
+        if (self.planned is None) and not self.archive_only:
+            self._remove_old_search_state()
+        deps_hash = self._get_search_deps_hash(index)
+        self.manifest.set_deps(self.get_publish_file('search/posts.json'), deps_hash)
+        reason = self._get_search_index_reason(deps_hash)
+        if reason is None:
+            # posts are not rendered just to find their terms
+            for path in self._get_old_search_files():
+                self.manifest.keep(self.get_publish_file(path))
+            return
+        if self.planned is not None:
+            for path in self._get_old_search_files() or [ 'search/posts.json', 'search/shards.json' ]:
+                self._plan_output('write', self.get_publish_file(path), reason)
+            return
+        for post in self.src.get_post_list():
+            index.add_post(post, self.get_page_html)
+        self._write_search_files(index)
+        index.write_state()
+        self.search_terms = index.terms
+
+    def _make_search_files(self):
+        """Return the search files (as a dict of name to content) without writing them"""
+        index = blogenlib.search.SearchIndex(None, old_terms=self.search_terms, post_index_hash=self.post_index_hash)
+        for post in self.src.get_post_list():
+            index.add_post(post, self.get_page_html)
+        self.search_terms = index.terms
+        return index.get_files(self.src.get_post_list(), lambda post: post.get_publish_url())
+
+    def _get_search_deps_hash(self, index):
+        deps = [ [ post.get_publish_url(), post.get_title(), post.get_date(), index.get_post_hash(post) ]
+                 for post in self.src.get_post_list() ]
+        return blogenlib.cache.make_key(json.dumps(deps))
+
+    def _get_old_search_files(self):
+        return sorted(path for path in self.manifest.old_files if path.startswith('search/'))
+
+    def _get_search_index_reason(self, deps_hash):
+        if self.force_pages:
+            return self.force_reason
+        if self.manifest.get_old_deps(self.get_publish_file('search/posts.json')) != deps_hash:
+            return 'posts changed'
+        old_files = self._get_old_search_files()
+        if (not old_files) or not all(os.path.isfile(self.get_publish_file(path)) for path in old_files):
+            return 'output missing'
+        return None
+
+    def _write_search_files(self, index):
+        for name, content in index.get_files(self.src.get_post_list(), lambda post: post.get_publish_url()).items():
+            filename = self.get_publish_file(blogenlib.url_join('search', name))
+            data = content.encode('utf-8')
+            if (self.force_pages or (self.manifest.get_old_hash(filename) != hashlib.sha1(data).hexdigest()) or
+                not os.path.isfile(filename)):
+                self._write_file_data(filename, data)
+            else:
+                self.manifest.keep(filename)
+
+    def _remove_old_manifests(self):
+        # without cache_dir (or in older versions) the manifests are
+        # kept in the publish dir
+        if self.get_manifest_dir() == self.conf.publish_dir:
+            return
+        for name in os.listdir(self.conf.publish_dir):
+            if name.startswith('.blogen-manifest.') and name.endswith('.json'):
+                os.remove(self.get_publish_file(name))
+
+    def _remove_old_search_state(self):
+        # older versions kept the search state in the publish dir
+        search_dir = self.get_publish_file('search')
+        try:
+            names = os.listdir(search_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.startswith('.terms.') and name.endswith('.json'):
+                os.remove(os.path.join(search_dir, name))
+
+    def _merge_search_index(self, num_shards):
+        """Merge the search terms found by sharded builds and write the search files"""
+        self.src = blogenlib.source.Source(self.cfg)
+        self._check_post_index()
+        index = blogenlib.search.SearchIndex(self._get_search_state_file(), post_index_hash=self.post_index_hash)
+        for shard in range(num_shards):
+            shard_index = blogenlib.search.SearchIndex(self._get_search_state_file((shard, num_shards)))
+            index.add_terms(shard_index.old_terms)
+        post_list = self.src.get_post_list()
+        missing = [ post.get_name() for post in post_list if post.get_name() not in index.terms ]
+        if missing:
+            return [ 'missing search terms of {} posts (shards must use the same cache_dir)'.format(len(missing)) ]
+        # drop terms of posts removed since the shards were built
+        index.terms = { post.get_name(): index.terms[post.get_name()] for post in post_list }
+        self.manifest.set_deps(self.get_publish_file('search/posts.json'), self._get_search_deps_hash(index))
+        self.num_files_written = 0
+        self._remove_old_search_state()
+        self._write_search_files(index)
+        index.write_state()
+        return []
+
+    def _get_fingerprinted_name(self, filename, name):
+        key = blogenlib.cache.get_file_key(filename)
+        digest = self.shared.asset_digests.get(key, None)
+        if digest is None:
+            with open(filename, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:12]
+            self.shared.asset_digests[key] = digest
+        (base, ext) = os.path.splitext(name)
+        return '{}.{}{}'.format(base, digest, ext)
 
-        filename = self.get_publish_file('atom.xml')
-        content = self.tpl.build('atom', data)
-        self._write_file(filename, content)
-            
     def _add_static_assets(self):
+        fingerprint = self.conf.fingerprint_assets
         def add_assets(root, prefix):
             for name in os.listdir(root):
-                prefixed_name = os.path.join(prefix, name)
+                prefixed_name = blogenlib.url_join(prefix, name)
                 filename = os.path.join(root, name)
                 if os.path.isdir(filename):
                     add_assets(filename, prefixed_name)
                 elif os.path.isfile(filename):
-                    self.copy_files.add(filename, prefixed_name)
-        add_assets(os.path.join(self.cfg.v.assets_dir, 'static'), self.cfg.v.publish_dir)
-                    
+                    if fingerprint:
+                        publish_name = self._get_fingerprinted_name(filename, prefixed_name)
+                    else:
+                        publish_name = prefixed_name
+                    self.asset_urls[prefixed_name] = self.get_publish_url(publish_name)
+                    self.copy_files.add(filename, self.get_publish_file(publish_name))
+        add_assets(os.path.join(self.conf.assets_dir, 'static'), '')
+
+    def _read_asset_manifest(self):
+        try:
+            with open(self.get_publish_file('asset-manifest.json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _check_asset_manifest(self):
+        # pages embed asset URLs, so they must be rebuilt if any URL
+        # changed; without fingerprinting the URLs are the asset names,
+        # so they only changed if the last build used fingerprinting
+        self.manifest.set_info('fingerprint_assets', self.conf.fingerprint_assets)
+        if not self.conf.fingerprint_assets:
+            if self.manifest.get_old_info('fingerprint_assets'):
+                self.log('   -> asset URLs changed, rebuilding all pages')
+                if not self.force_pages:
+                    self.force_reason = 'asset URLs changed'
+                self.force_pages = True
+            return
+        old_asset_urls = self._read_asset_manifest()
+        if old_asset_urls != self.asset_urls:
+            self.log('   -> asset URLs changed, rebuilding all pages')
+            if not self.force_pages:
+                self.force_reason = 'asset URLs changed' if old_asset_urls is not None else 'asset manifest missing'
+            self.force_pages = True
+
+    def _write_asset_manifest(self):
+        filename = self.get_publish_file('asset-manifest.json')
+        if not (self.conf.fingerprint_assets and self.in_shard(filename)):
+            return
+        if not self.force_pages:
+            self.manifest.keep(filename)
+            return
+        if self._plan_output('write', filename, self.force_reason):
+            return
+        content = json.dumps(self.asset_urls, indent=2, sort_keys=True) + '\n'
+        self._write_file(filename, content)
+
     def _set_page_link_vars(self):
-        if self.cfg.enabled('build_archives'):
+        if self.conf.build_archives:
             self.extra_vars['archives_url'] = self.get_publish_url('/archives')
-        if self.cfg.enabled('build_atom'):
+        if self.conf.build_atom:
             self.extra_vars['atom_url']     = self.get_publish_url('/atom.xml')
+        if self.conf.build_json_feed:
+            self.extra_vars['json_feed_url'] = self.get_publish_url('/feed.json')
         for name, page in self.src.get_page_map().items():
             self.extra_vars[name + '_url']  = page.get_publish_url()
 
+    def _get_html_cache_key(self, page):
+        return blogenlib.cache.make_key('html', page.get_text(), page.get_publish_url(), self.conf.publish_url,
+                                        self.renderer.get_highlighter_id())
+
+    def _load_cached_html(self, page):
+        entry = self.build_cache.get_json('html', self._get_html_cache_key(page))
+        if entry is None:
+            return False
+        if entry['uses_commands'] and entry['post_index'] != self.post_index_hash:
+            return False
+        # this also adds the images to the list of files to copy
+        for image in entry['images']:
+            if self.renderer.get_image_info(image['url']) != image['info']:
+                return False
+        page.set_html(entry['html'], uses_commands=entry['uses_commands'],
+                      images=[ (image['url'], image['info']) for image in entry['images'] ], excerpt_html=entry['excerpt'])
+        return True
+
+    def _store_cached_html(self, page):
+        entry = {
+            'html':          page.get_html(),
+            'excerpt':       page.get_excerpt_html() if page.has_excerpt() else None,
+            'uses_commands': page.uses_commands,
+            'post_index':    self.post_index_hash,
+            'images':        [ { 'url': url, 'info': info } for url, info in page.images ],
+        }
+        self.build_cache.put_json('html', self._get_html_cache_key(page), entry)
+
+    def _get_rendered_page_info(self, page):
+        # what the HTML of a page depends on, kept in the manifest so
+        # planning a build doesn't need to render the page
+        return {
+            'key':        self._get_html_cache_key(page),
+            'links':      self.page_links.get(page, None),
+            'images':     [ [ url, info ] for url, info in page.images ],
+            'html':       blogenlib.cache.make_key(page.get_html()),
+        }
+
+    def _get_old_rendered_page_info(self, page):
+        """Return the rendered page info from the last build, or None if the page would be rendered differently"""
+        info = (self.manifest.get_old_info('rendered') or {}).get(page.get_publish_url(), None)
+        if (info is None) or (info['key'] != self._get_html_cache_key(page)):
+            return None
+        if info['links'] != self.page_links.get(page, None):
+            return None
+        return info
+
+    def _set_rendered_page_info(self):
+        rendered = {}
+        for page in self.src.get_page_list():
+            if page.get_html() is not None:
+                rendered[page.get_publish_url()] = self._get_rendered_page_info(page)
+            else:
+                # not rendered by this shard
+                info = self._get_old_rendered_page_info(page)
+                if info is not None:
+                    rendered[page.get_publish_url()] = info
+        self.manifest.set_info('rendered', rendered)
+
+    def _get_page_html_hash(self, page):
+        """Get the hash of the HTML of a page
+
+        If the page was not rendered, the hash from the last build is
+        used if the page would be rendered the same, so the page is not
+        rendered (for example, when planning or sharding).
+        """
+        if (self.manifest is not None) and (page.get_html() is None):
+            info = self._get_old_rendered_page_info(page)
+            if (info is not None) and all(self.renderer.get_image_info(url) == image_info for url, image_info in info['images']):
+                return info['html']
+        return blogenlib.cache.make_key(self.get_page_html(page))
+
+    def _render_page(self, page):
+        self.stale_image_pages.discard(page)
+        if self.build_cache and self._load_cached_html(page):
+            self.log("   -> using cached {}".format(page.get_source_filename()))
+            return
+        self.log("   -> parsing {}".format(page.get_source_filename()))
+        with self.profiler.item('parse', page.get_source_filename()), self.events.span('parse', file=page.get_source_filename()):
+            markdown = self.parser.parse(page.get_text())
+        with self.profiler.item('render', page.get_source_filename()), self.events.span('render', file=page.get_source_filename()):
+            (html, excerpt_html) = self.renderer.render_with_excerpt(markdown)
+            images = [ (el.url, self.renderer.get_image_info(el.url)) for el in markdown.get_elements(blogenlib.markdown.ImageElement) ]
+            page.set_html(html, excerpt_html=excerpt_html,
+                          uses_commands=bool(markdown.get_elements(blogenlib.markdown.CommandElement)),
+                          images=images)
+        if self.build_cache:
+            self._store_cached_html(page)
+
+    def get_page_html(self, page):
+        """Get the HTML of a page, rendering it if necessary"""
+        if (page.get_html() is None) or (page in self.stale_image_pages):
+            self._render_page(page)
+        return page.get_html()
+
+    def get_page_excerpt(self, page):
+        """Get the HTML excerpt of a page, rendering only the excerpt if possible"""
+        if page.get_excerpt_html() is not None:
+            return page.get_excerpt_html()
+        if self.build_cache and self._load_cached_html(page):
+            return page.get_excerpt_html()
+        markdown = self.parser.parse(page.get_text(), excerpt_only=True)
+        if not markdown.has_excerpt():
+            self._render_page(page)
+        else:
+            self.log("   -> parsing excerpt of {}".format(page.get_source_filename()))
+            page.set_excerpt_html(self.renderer.render(markdown))
+        return page.get_excerpt_html()
+
     def _render_pages(self):
         self.log("-> parsing sources")
-        for page_list in [ self.src.get_post_list(), self.src.get_page_list() ]:
-            for page in page_list:
-                self.log("   -> parsing {}".format(page.get_source_filename()))
-                markdown = self.parser.parse(page.get_text())
-                page.set_html(self.renderer.render(markdown))
+        self.rerendered_pages = set()
+        # the page list includes posts and single pages
+        for page in self.src.get_page_list():
+            if not self._page_needs_render(page):
+                continue
+            if page.get_html() is not None:
+                self.rerendered_pages.add(page)
+            self._render_page(page)
+        if self.rerendered_pages:
+            self.post_list_changed = True
+
+    def _check_page_images(self):
+        # pages kept from a previous build add their images to the files
+        # to copy again; if an image URL or size changed (for example,
+        # when a post date changes), the page must be rendered again
+        self.stale_image_pages = set()
+        for page in self.src.get_page_list():
+            if page.get_html() is None:
+                continue
+            for url, info in page.images:
+                if self.renderer.get_image_info(url) != info:
+                    self.stale_image_pages.add(page)
+
+    def _page_needs_render(self, page):
+        # pages kept from a previous build (see watch mode) only need to
+        # be rendered again if something they depend on has changed
+        if page.get_html() is None:
+            return True
+        if page.uses_commands and self.post_index_changed:
+            return True
+        if page in self.stale_image_pages:
+            return True
+        return False
+
+    def _get_output_jobs(self):
+        """Return the jobs of the output phase, functions that can run in any order"""
+        jobs = []
+        for post in self.src.get_post_list():
+            jobs.append(functools.partial(self._build_post_page, post))
+        for page in self.src.get_single_page_list():
+            jobs.append(functools.partial(self._build_single_page, page, 'single_page', os.path.join(page.get_publish_dir(), 'index.html')))
+        jobs.append(functools.partial(self._build_post_list, self._get_index_post_list()))
+        if self.conf.build_archives:
+            jobs.append(functools.partial(self._build_post_list, self._get_archive_post_list()))
+        if self.conf.build_months:
+            for month in self.src.get_month_list():
+                jobs.append(functools.partial(self._build_post_list, self._get_month_post_list(month)))
+        if self.conf.build_tags:
+            for tag in self.src.get_tag_list():
+                jobs.append(functools.partial(self._build_post_list, self._get_tag_post_list(tag)))
+        if self.conf.build_atom:
+            jobs.append(self._build_atom_feed)
+        if self.conf.build_json_feed:
+            jobs.append(self._build_json_feed)
+        if self.conf.build_sitemap:
+            jobs.append(self._build_sitemap)
+        if self.conf.build_search:
+            jobs.append(self._build_search_index)
+        return jobs
+
+    def _run_job_in_worker(self, job):
+        # the results of a job are sent back to the main process,
+        # which adds them to its manifest and file list
+        self.manifest.files = {}
+        self.manifest.info = {}
+        self.num_files_written = 0
+        self.log_lines = []
+        self.events.start_recording()
+        self.profiler.start_recording()
+        if self.archive is not None:
+            self.archive = blogenlib.archive.ArchiveEntries()
+        copy_files = set(self.copy_files.files)
+        job()
+        return {
+            'archive':    self.archive.entries if self.archive is not None else [],
+            'files':      self.manifest.files,
+            'deps':       self.manifest.info.get('deps', {}),
+            'written':    self.num_files_written,
+            'log':        self.log_lines,
+            'events':     self.events.stop_recording(),
+            'profile':    self.profiler.stop_recording(),
+            'copy_files': [ copy_file for dest, copy_file in self.copy_files.files.items() if dest not in copy_files ],
+        }
+
+    def _run_jobs_in_workers(self, jobs, num_workers):
+        global _worker_builder, _worker_jobs
+        # workers are forked, so they get the rendered pages and
+        # compiled templates without copying them
+        (_worker_builder, _worker_jobs) = (self, jobs)
+        # workers send the archive entries back instead of writing
+        # them, and must not get the archive (closing their copy of it
+        # would write to the file)
+        archive = self.archive
+        if archive is not None:
+            self.archive = blogenlib.archive.ArchiveEntries()
+        try:
+            with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+                chunk_size = max(1, len(jobs) // (num_workers * 8))
+                # results come in the order of the jobs, so the build is
+                # the same as a sequential one
+                for result in pool.imap(_run_output_job, range(len(jobs)), chunk_size):
+                    self.manifest.files.update(result['files'])
+                    for path, data in result['archive']:
+                        archive.add_data(path, data)
+                    for path, deps_hash in result['deps'].items():
+                        self.manifest.info.setdefault('deps', {})[path] = deps_hash
+                    self.num_files_written += result['written']
+                    for msg in result['log']:
+                        print(msg)
+                    self.events.replay(result['events'])
+                    self.profiler.add_items(result['profile'])
+                    for copy_file in result['copy_files']:
+                        self.copy_files.add(copy_file.src, copy_file.dest)
+        finally:
+            (_worker_builder, _worker_jobs) = (None, None)
+            self.archive = archive
+
+    def get_num_workers(self):
+        num_workers = self.opts.jobs or os.cpu_count() or 1
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return 1
+        return num_workers
 
     def _output(self):
         self.log("-> building output")
         self.num_files_written = 0
-        for post in self.src.get_post_list():
-            self._build_post_page(post)
-        for page in self.src.get_single_page_list():
-            if self.opts.force_rebuild or page.needs_update():
-                self._build_single_page(page, 'single_page', os.path.join(page.get_publish_dir(), 'index.html'))
-        self._build_post_list(self.src.get_post_list(), 'index', self.cfg.int('posts_in_index_page', defval=5), { 'first' : 'index.html', 'rest': 'page{}.html' })
-        if self.cfg.enabled('build_archives'):
-            self._build_post_list(self.src.get_post_list(), 'archives', self.cfg.int('posts_in_archive_page', defval=5), { 'first' : 'archives/index.html', 'rest': 'archives/page{}.html' })
-        if self.cfg.enabled('build_months'):
-            self._build_month_pages()
-        if self.cfg.enabled('build_tags'):
-            self._build_tag_pages()
-        if self.cfg.enabled('build_atom'):
-            self._build_atom_feed()
+        jobs = self._get_output_jobs()
+        num_workers = min(self.get_num_workers(), len(jobs))
+        if num_workers > 1:
+            self.log('   -> using {} workers'.format(num_workers))
+            self._run_jobs_in_workers(jobs, num_workers)
+        else:
+            for job in jobs:
+                job()
+        self._write_asset_manifest()
         self.log('   -> {} files built'.format(self.num_files_written))
-    
+
+    def _copy_files(self):
+        if self.planned is not None:
+            for copy_file in self.copy_files.get_list():
+                if not self.in_shard(copy_file.dest):
+                    continue
+                reason = self.copy_files.get_copy_reason(copy_file, force=self.opts.force_rebuild)
+                if reason is None:
+                    self.manifest.keep(copy_file.dest)
+                else:
+                    self._plan_output('copy', copy_file.dest, reason)
+            return
         self.log('-> copying files')
-        num_files = self.copy_files.copy(force=self.opts.force_rebuild, verbose=self.opts.verbose)
+        if self.archive_only:
+            num_files = self._archive_copy_files()
+        else:
+            on_copy = self._archive_copied_file if self.archive is not None else None
+            num_files = self.copy_files.copy(force=self.opts.force_rebuild, verbose=self.opts.verbose, manifest=self.manifest, select=self.in_shard,
+                                             events=self.events, on_copy=on_copy)
         self.log('   -> {} files copied'.format(num_files))
 
-    def build(self):
-        self.log("-> reading sources")
-        self.src = blogenlib.source.Source(self.cfg)
-        self.parser = blogenlib.markdown.Parser()
-        self.tpl = blogenlib.template.TemplateProcessor(os.path.join(self.cfg.v.assets_dir, 'tpl'))
-        self.renderer = blogenlib.renderer.Renderer(self.cfg, self.src, self.copy_files)
+    def _archive_copied_file(self, copy_file):
+        self.archive.add_file(self.manifest.get_path(copy_file.dest), copy_file.dest)
+
+    def _archive_copy_files(self):
+        num_files = 0
+        for copy_file in self.copy_files.get_list():
+            if not self.in_shard(copy_file.dest):
+                continue
+            self.log('   -> archiving {}'.format(copy_file.src))
+            try:
+                self.archive.add_file(self.manifest.get_path(copy_file.dest), copy_file.src)
+            except OSError as e:
+                print("* WARNING: error archiving '{}': {}".format(copy_file.src, e))
+                continue
+            if self.opts.manifest:
+                self.manifest.add_file(copy_file.dest, src_file=copy_file.src)
+            self.events.emit('copy_file', src=copy_file.src, file=copy_file.dest)
+            num_files += 1
+        return num_files
+
+    def _check_post_list(self):
+        # removed or renamed posts don't change the last post mtime,
+        # so check the list of posts against the previous build
+        post_urls = [ post.get_publish_url() for post in self.src.get_post_list() ]
+        self.manifest.set_info('posts', post_urls)
+        old_post_urls = self.manifest.get_old_info('posts')
+        if (old_post_urls is not None) and (old_post_urls != post_urls):
+            self.log('   -> list of posts changed, rebuilding post lists')
+            self.post_list_changed = True
 
+    def _get_linked_posts(self, page):
+        """Return the URL and title of the posts a page links to with post_link"""
+        ret = []
+        if '{%' not in page.get_text():
+            return ret
+        for match in command_re.finditer(page.get_text()):
+            cmd = re.fullmatch(r'\s*post_link\s+(.*)', match.group(1), re.DOTALL)
+            if not cmd:
+                continue
+            args = self.renderer._parse_command_args(cmd.group(1))
+            post = self.src.get_post(args[0]) if args else None
+            ret.append([ post.get_publish_url(), post.get_title() ] if post else None)
+        return ret
+
+    def _check_linked_posts(self):
+        # pages show titles and URLs of other posts (older and newer
+        # posts, or with commands like post_link), so they must be
+        # rebuilt when those change since the last build
+        self.page_links = {}
+        links = {}
+        for page in self.src.get_page_list():
+            page_links = self._get_linked_posts(page)
+            if page_links:
+                self.page_links[page] = page_links
+                links[page.get_publish_url()] = page_links
+        self.manifest.set_info('links', links)
+        old_links = self.manifest.get_old_info('links') or {}
+        self.links_changed = set(page for page in self.src.get_page_list()
+                                 if old_links.get(page.get_publish_url(), None) != links.get(page.get_publish_url(), None))
+        siblings = {}
+        for post in self.src.get_post_list():
+            siblings[post.get_name()] = [ [ other.get_publish_url(), other.get_title() ] if other else None
+                                          for other in (post.get_older_post(), post.get_newer_post()) ]
+        self.manifest.set_info('siblings', siblings)
+        old_siblings = self.manifest.get_old_info('siblings') or {}
+        self.siblings_changed = set(name for name, entries in siblings.items() if old_siblings.get(name, None) != entries)
+
+    def _check_related_posts(self):
+        # post pages must be rebuilt when their list of related posts
+        # changes, or the URL or title of a related post changes
+        related = {}
+        for post in self.src.get_post_list():
+            related[post.get_name()] = [ [ other.get_publish_url(), other.get_title() ] for other in self.src.get_related_posts(post) ]
+        self.manifest.set_info('related', related)
+        old_related = self.manifest.get_old_info('related') or {}
+        self.related_changed = set(name for name, entries in related.items() if old_related.get(name, None) != entries)
+
+    def _prune_outputs(self):
+        removed = self.manifest.get_removed()
+        if not removed:
+            return
+        self.log('-> removing stale files')
+        publish_dir = self.conf.publish_dir
+        for path in removed:
+            filename = self.get_publish_file(path)
+            self.log('   -> removing {}'.format(filename))
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            # remove directories left empty
+            dirname = os.path.dirname(os.path.abspath(filename))
+            while dirname.startswith(publish_dir + os.sep):
+                try:
+                    os.rmdir(dirname)
+                except OSError:
+                    break
+                dirname = os.path.dirname(dirname)
+        self.log('   -> {} files removed'.format(len(removed)))
+
+    def _write_manifest(self):
+        self.manifest.write()
+        self._remove_old_manifests()
+        if self.opts.manifest:
+            self.log('-> writing manifest to {}'.format(self.opts.manifest))
+            self.manifest.write_report(self.opts.manifest, delta=self.opts.manifest_delta)
+
+    def invalidate_templates(self):
+        """Make the next build re-read templates and rebuild all pages"""
+        self.templates_changed = True
+
+    def _check_post_index(self):
+        # pages with commands like post_link must be rendered again
+        # when posts are added, removed or renamed
+        post_index = [ (post.get_name(), post.get_publish_url(), post.get_title()) for post in self.src.get_post_list() ]
+        self.post_index_changed = (self.post_index is not None) and (self.post_index != post_index)
+        self.post_index = post_index
+        self.post_index_hash = blogenlib.cache.make_key(json.dumps(post_index))
+
+    def _reset(self):
+        # the config can change between builds (staged builds set a new publish_dir)
+        self.conf = self.cfg.snapshot()
+        self.force_reason = None
+        if self.opts.force_rebuild:
+            self.force_reason = 'forced rebuild'
+        elif self.templates_changed:
+            self.force_reason = 'templates changed'
+        elif self.archive_only:
+            # the archive has all files, not only the changed ones
+            self.force_reason = 'building archive'
+        self.force_pages = self.force_reason is not None
+        self.post_list_changed = False
+        self.common_vars = None
+        self.common_vars_hash = None
+        self.extra_vars = {}
+        self.asset_urls = {}
+        self.post_list_items = {}
+        if self.tpl is None:
+            # parsed and rendered markdown blocks are only needed again
+            # by later builds (when watching or serving the blog)
+            self.parser = blogenlib.markdown.Parser(self.opts.keep_blocks)
+            self.tpl = self.shared.get_template_processor(os.path.join(self.conf.assets_dir, 'tpl'),
+                                                          self.conf.autoescape_templates)
+            self.renderer = blogenlib.renderer.Renderer(self.cfg, self.src, self.copy_files, self.build_cache, shared=self.shared,
+                                                        cache_blocks=self.opts.keep_blocks)
+        else:
+            self.renderer.set_source(self.src)
+            if self.templates_changed:
+                self.tpl.clear_cache()
+            # files to copy are found again in every build, so files of
+            # removed pages are not copied anymore
+            self.copy_files.clear()
+            self.renderer.clear_image_cache()
+        # parsed and rendered markdown blocks are kept from the previous
+        # build, so editing a post only processes the blocks that changed
+        self.parser.block_cache.new_generation()
+        self.renderer.block_cache.new_generation()
+        # list entries of posts are cached while building the lists
+        self.tpl.fragment_cache = blogenlib.cache.FragmentCache(self.build_cache)
+
+    def prepare(self):
+        """Read sources and set up everything needed to build pages"""
+        self.log("-> reading sources")
+        with self.profiler.phase('read'):
+            self.src = blogenlib.source.Source(self.cfg, old_source=self.src)
+        self.events.emit('source_loaded', posts=len(self.src.get_post_list()), pages=len(self.src.get_single_page_list()))
+        self._reset()
+        self._check_post_index()
+        self._check_page_images()
         self._set_page_link_vars()
         self._add_static_assets()
-        self._render_pages()
-        self._output()
+
+    def merge_shards(self, num_shards):
+        """Merge the manifests written by sharded builds into the main manifest.
+
+        Returns the list of problems found: missing shard manifests,
+        files claimed by more than one shard or by the wrong shard, and
+        files missing from the publish dir.  With build_search, the
+        search files are written from the terms found by the shards.
+        """
+        self.manifest = self._open_manifest()
+        errors = []
+        owner = {}
+        for shard in range(num_shards):
+            shard_manifest = self._open_manifest((shard, num_shards))
+            if not os.path.isfile(shard_manifest.filename):
+                errors.append('missing manifest for shard {}/{}: {}'.format(shard + 1, num_shards, shard_manifest.filename))
+                continue
+            if shard == 0:
+                self.manifest.set_info('posts', shard_manifest.get_old_info('posts'))
+                for key in ('related', 'siblings', 'links', 'fingerprint_assets'):
+                    self.manifest.set_info(key, shard_manifest.get_old_info(key))
+            # each shard has the info of the pages it rendered
+            self.manifest.info.setdefault('rendered', {}).update(shard_manifest.get_old_info('rendered') or {})
+            for path, deps_hash in (shard_manifest.get_old_info('deps') or {}).items():
+                self.manifest.info.setdefault('deps', {})[path] = deps_hash
+            for path, info in shard_manifest.old_files.items():
+                if path in owner:
+                    errors.append('file {} built by shards {} and {}'.format(path, owner[path] + 1, shard + 1))
+                    continue
+                owner[path] = shard
+                if get_shard(path, num_shards) != shard:
+                    errors.append('file {} built by shard {}, expected {}'.format(path, shard + 1, get_shard(path, num_shards) + 1))
+                filename = self.get_publish_file(path)
+                if (not os.path.isfile(filename)) or (os.stat(filename).st_size != info['size']):
+                    errors.append('file {} missing or with wrong size in publish dir'.format(path))
+                self.manifest.files[path] = info
+        if (not errors) and self.conf.build_search:
+            errors.extend(self._merge_search_index(num_shards))
+        if not errors:
+            self.manifest.write()
+            self._remove_old_manifests()
+        return errors
+
+    def _add_page_images(self):
+        # images are added to the files to copy when pages are
+        # rendered, so when planning or sharding (when pages are only
+        # rendered if needed) they're taken from the manifest, or found
+        # by rendering (or parsing, when planning) the pages changed
+        # since the last build
+        for page in self.src.get_page_list():
+            if page.get_html() is not None:
+                continue
+            info = self._get_old_rendered_page_info(page)
+            if info is not None:
+                for url, image_info in info['images']:
+                    self.renderer.get_image_info(url)
+                continue
+            if self.planned is None:
+                self.get_page_html(page)
+                continue
+            if self.build_cache and self._load_cached_html(page):
+                continue
+            markdown = self.parser.parse(page.get_text())
+            for el in markdown.get_elements(blogenlib.markdown.ImageElement):
+                self.renderer.get_image_info(el.url)
+
+    def plan(self):
+        """Check what a build would do, without writing anything.
+
+        Returns a BuildPlan with the list of files that would be
+        written, copied or removed (each with the reason) and the
+        number of files that would be left untouched.  Pages are not
+        rendered, except posts in the feeds changed since the last build
+        (their contents are part of what the feeds depend on).  Nothing
+        is stored in the build cache.
+        """
+        self.planned = []
+        if self.build_cache:
+            self.build_cache.read_only = True
+        try:
+            self.prepare()
+            self.manifest = self._open_manifest(self.shard)
+            self._check_post_list()
+            self._check_linked_posts()
+            self._check_related_posts()
+            self._check_asset_manifest()
+            self._add_page_images()
+            for job in self._get_output_jobs():
+                job()
+            self._write_asset_manifest()
+            self._copy_files()
+            outputs = self.planned
+            if self.conf.prune_output:
+                planned_files = set(output.file for output in outputs)
+                for path in self.manifest.get_removed():
+                    if path not in planned_files:
+                        outputs.append(PlannedOutput(action='remove', file=path, reason='not produced by the build'))
+            return BuildPlan(outputs=outputs, num_unchanged=len(self.manifest.files))
+        finally:
+            self.planned = None
+            if self.build_cache:
+                self.build_cache.read_only = False
+
+    def build(self):
+        """Build the blog.
+
+        The builder can be used for more than one build: sources,
+        templates and rendered pages are kept from the previous build
+        and only updated where needed.
+        """
+        with self.events.span('build'):
+            self.prepare()
+            self.manifest = self._open_manifest(self.shard)
+            self._check_post_list()
+            self._check_linked_posts()
+            self._check_related_posts()
+            self._check_asset_manifest()
+            if self.shard is None:
+                # when sharding, pages are rendered only when needed
+                with self.profiler.phase('render'):
+                    self._render_pages()
+                if self.build_cache:
+                    self.log('   -> build cache: {} hits, {} misses'.format(self.build_cache.hits, self.build_cache.misses))
+            else:
+                self._add_page_images()
+            if self.opts.archive:
+                self.log('-> writing archive {}'.format(self.opts.archive))
+                self.archive = blogenlib.archive.open_archive(self.opts.archive)
+            try:
+                with self.profiler.phase('output'):
+                    self._output()
+                with self.profiler.phase('copy'):
+                    self._copy_files()
+                self._set_rendered_page_info()
+            finally:
+                if self.archive is not None:
+                    self.archive.close()
+                    self.archive = None
+            if self.archive_only:
+                # the publish dir is left untouched
+                if self.opts.manifest:
+                    self.manifest.write_report(self.opts.manifest, delta=self.opts.manifest_delta)
+            else:
+                if self.conf.prune_output:
+                    self._prune_outputs()
+                self._write_manifest()
+            self.templates_changed = False
+    
\ No newline at end of file
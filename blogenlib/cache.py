@@ -0,0 +1,199 @@
+
+import hashlib
+import json
+import os
+import tempfile
+
+import blogenlib.template
+
+# change this when a change in blogen makes cached data invalid
+CACHE_VERSION = '3'
+
+def make_key(*parts):
+    """Make a cache key from strings or bytes"""
+    digest = hashlib.sha256(CACHE_VERSION.encode('utf-8'))
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def hash_file(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(65536)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_file_key(filename):
+    """Key for data read from a file, which changes when the file changes"""
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+class DirectoryStorage:
+    """Store cache entries as files in a directory
+
+    Entries are written to a temporary file and renamed, so the
+    directory can be shared (for example, in a network mount) by
+    builds running at the same time.
+
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_filename(self, kind, key):
+        return os.path.join(self.cache_dir, kind, key[:2], key)
+
+    def get(self, kind, key):
+        try:
+            with open(self.get_filename(kind, key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, kind, key, data):
+        filename = self.get_filename(kind, key)
+        dirname = os.path.dirname(filename)
+        os.makedirs(dirname, exist_ok=True)
+        (fd, tmp_filename) = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+class BuildCache:
+    """Content-addressed cache of build artifacts
+
+    Entries are grouped by kind ('html', 'image', ...) and addressed
+    by a key made from the hash of everything the entry depends on.
+    The storage can be any object with get(kind, key) and
+    put(kind, key, data) methods.  A read-only cache (used when
+    planning a build) doesn't store new entries.
+
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.read_only = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, key):
+        data = self.storage.get(kind, key)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, kind, key, data):
+        if not self.read_only:
+            self.storage.put(kind, key, data)
+
+    def get_json(self, kind, key):
+        data = self.get(kind, key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def put_json(self, kind, key, value):
+        self.put(kind, key, json.dumps(value).encode('utf-8'))
+
+class FragmentCache:
+    """Cache of rendered template fragments
+
+    Fragments are kept in memory for the current build and, if a build
+    cache is given, stored in it for the next builds.
+
+    """
+
+    def __init__(self, build_cache=None):
+        self.build_cache = build_cache
+        self.fragments = {}
+
+    def get(self, key_parts):
+        if key_parts in self.fragments:
+            return self.fragments[key_parts]
+        if self.build_cache is None:
+            return None
+        fragment = self.build_cache.get_json('fragment', make_key('fragment', *key_parts))
+        if fragment is not None:
+            self.fragments[key_parts] = fragment
+        return fragment
+
+    def put(self, key_parts, fragment):
+        self.fragments[key_parts] = fragment
+        if self.build_cache is not None:
+            self.build_cache.put_json('fragment', make_key('fragment', *key_parts), fragment)
+
+class BlockCache:
+    """In-memory cache of markdown blocks, keyed by their source text
+
+    This is used in watch mode, where a post being edited is parsed
+    and rendered again on every change: only the blocks that changed
+    need to be processed.  Entries not used since the previous call to
+    new_generation() are dropped when it's called again, so the cache
+    doesn't grow forever.  A disabled cache keeps nothing, for builds
+    that parse every block only once.
+
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.entries = {}
+        self.old_entries = {}
+
+    def new_generation(self):
+        self.old_entries = self.entries
+        self.entries = {}
+
+    def clear(self):
+        self.entries = {}
+        self.old_entries = {}
+
+    def get(self, key):
+        value = self.entries.get(key, None)
+        if value is None:
+            value = self.old_entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        if self.enabled:
+            self.entries[key] = value
+
+class SharedCaches:
+    """In-memory caches that can be shared by builders of different sites
+
+    Sites with the same template dir share the compiled templates.
+    Image sizes and asset fingerprints are kept by file, and
+    highlighted code by its contents, so they can be shared by any
+    sites.
+
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.image_sizes = {}
+        self.asset_digests = {}
+        self.highlighted = {}
+
+    def get_template_processor(self, tpl_dir, autoescape):
+        key = (os.path.abspath(tpl_dir), bool(autoescape))
+        if key not in self.templates:
+            self.templates[key] = blogenlib.template.TemplateProcessor(tpl_dir, autoescape=autoescape)
+        return self.templates[key]
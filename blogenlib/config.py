@@ -1,35 +1,150 @@
+import collections
+import difflib
+import os
+import urllib.parse
 
-import re
+class ConfigError(Exception):
+    pass
 
 class ConfigData:
+    """Raw config values as attributes, None for options not set
+
+    blogen itself uses Config.snapshot(); this is kept for options
+    defined by plugins.
+    """
+
     def __init__(self, data):
         self._data = data
-    
-    def __setattribute__(self, name, val):
-        if name == '_data':
-            object.__setattribute__(self, '_data', val)
-        else:
-            data = object.__getattribute__(self, name)
-            data[name] = val
-    
-    def __getattribute__(self, name):
-        data = object.__getattribute__(self, '_data')
+
+    def __getattr__(self, name):
         if name == 'data':
-            return data
-        if name in data:
-            return data[name]
-        return None
+            return self._data
+        return self._data.get(name, None)
+
+def parse_str(key, val):
+    if isinstance(val, list):
+        raise ConfigError("'{}' must be a single value".format(key))
+    return val
+
+def parse_int(key, val):
+    try:
+        return int(parse_str(key, val))
+    except ValueError:
+        raise ConfigError("'{}' must be an integer, not '{}'".format(key, val))
+
+def parse_count(key, val):
+    num = parse_int(key, val)
+    if num < 1:
+        raise ConfigError("'{}' must be at least 1, not '{}'".format(key, val))
+    return num
+
+def parse_non_negative(key, val):
+    num = parse_int(key, val)
+    if num < 0:
+        raise ConfigError("'{}' must not be negative, not '{}'".format(key, val))
+    return num
+
+def parse_bool(key, val):
+    val = parse_str(key, val).lower()
+    if val in ('', '0', 'no', 'false', 'off'):
+        return False
+    if val in ('1', 'yes', 'true', 'on'):
+        return True
+    raise ConfigError("'{}' must be 0, 1, no, yes, false, true, off or on, not '{}'".format(key, val))
+
+def parse_path(key, val):
+    val = parse_str(key, val)
+    return os.path.abspath(val) if val else ''
+
+def parse_dir(key, val):
+    val = parse_path(key, val)
+    if not val:
+        raise ConfigError("'{}' must be set".format(key))
+    return val
+
+def parse_site_url(key, val):
+    val = parse_str(key, val)
+    if val and not urllib.parse.urlsplit(val).netloc:
+        raise ConfigError("'{}' must be an absolute URL like 'https://example.com', not '{}'".format(key, val))
+    return val.rstrip('/')
+
+def parse_url_path(key, val):
+    # same as blogenlib.url_join(val), without the package import
+    val = parse_str(key, val)
+    ret = val.strip().strip('/')
+    if val.startswith('/'):
+        return '/' + ret
+    return ret
+
+def parse_highlighter(key, val):
+    val = parse_str(key, val)
+    if val in ('', '0'):
+        return ''
+    if val in ('1', 'builtin'):
+        return 'builtin'
+    if val == 'pygments':
+        return val
+    raise ConfigError("'{}' must be builtin or pygments, not '{}'".format(key, val))
+
+# known options: (parser, value when not set)
+OPTIONS = {
+    'site_url':              (parse_site_url, ''),
+    'publish_url':           (parse_url_path, ''),
+    'blog_title':            (parse_str, ''),
+    'blog_subtitle':         (parse_str, ''),
+    'blog_author':           (parse_str, ''),
+
+    'source_dir':            (parse_dir, None),
+    'assets_dir':            (parse_dir, None),
+    'publish_dir':           (parse_dir, None),
+    'cache_dir':             (parse_path, ''),
+    'releases_dir':          (parse_path, ''),
+
+    'build_archives':        (parse_bool, False),
+    'build_months':          (parse_bool, False),
+    'build_tags':            (parse_bool, False),
+    'build_atom':            (parse_bool, False),
+    'build_json_feed':       (parse_bool, False),
+    'build_sitemap':         (parse_bool, False),
+    'build_search':          (parse_bool, False),
+
+    'minify_html':           (parse_bool, False),
+    'fingerprint_assets':    (parse_bool, False),
+    'prune_output':          (parse_bool, False),
+    'staged_builds':         (parse_bool, False),
+    'keep_releases':         (parse_count, 3),
+    'autoescape_templates':  (parse_bool, False),
+    'highlight_code':        (parse_highlighter, ''),
+
+    'posts_in_index_page':   (parse_count, 5),
+    'posts_in_archive_page': (parse_count, 5),
+    'posts_in_tag_page':     (parse_count, 5),
+    'posts_in_month_page':   (parse_count, 5),
+    'posts_in_atom_feed':    (parse_non_negative, 10),
+    'related_posts':         (parse_non_negative, 0),
+    'sitemap_max_urls':      (parse_count, 50000),
+}
+
+class ConfigSnapshot(collections.namedtuple('ConfigSnapshot', sorted(OPTIONS) + [ 'publish_url_prefix' ])):
+    """Typed, validated values of the known config options
+
+    Paths are absolute, and publish_url_prefix is publish_url ready to
+    have a relative URL appended.
+    """
+    __slots__ = ()
 
 class Config:
 
     def __init__(self, filename):
         data = {}
         with open(filename, 'r') as f:
-            for line in f:
+            for line_num, line in enumerate(f, 1):
                 line = line.strip()
                 if (not line) or line.startswith('#'):
                     continue
 
+                if '=' not in line:
+                    raise ConfigError("{}:{}: expected 'key = value'".format(filename, line_num))
                 (key, val) = line.split('=', maxsplit=1)
                 key = key.strip()
                 val = val.strip()
@@ -40,18 +155,44 @@ class Config:
                     data[key].append(val)
                 else:
                     data[key] = val
+        self.filename = filename
         self.data = data
         self.v = ConfigData(data)
+        self._snapshot = None
 
-    def enabled(self, key):
-        if key not in self.data:
-            return False
-        val = self.data[key]
-        if (val is None) or (val == '') or (val == '0'):
-            return False
-        return True
+    def set(self, key, val):
+        self.data[key] = val
+        self._snapshot = None
+
+    def snapshot(self):
+        """Return the ConfigSnapshot of the current values, raising ConfigError if any is invalid"""
+        if self._snapshot is None:
+            values = {}
+            errors = []
+            for key, (parse, defval) in OPTIONS.items():
+                try:
+                    if key in self.data:
+                        values[key] = parse(key, self.data[key])
+                    elif defval is None:
+                        values[key] = parse(key, '')  # required, raises an error
+                    else:
+                        values[key] = defval
+                except ConfigError as e:
+                    errors.append(str(e))
+            if errors:
+                raise ConfigError('{}: {}'.format(self.filename, '; '.join(errors)))
+            publish_url = values['publish_url']
+            values['publish_url_prefix'] = publish_url + '/' if publish_url not in ('', '/') else publish_url
+            self._snapshot = ConfigSnapshot(**values)
+        return self._snapshot
 
-    def int(self, key, defval = None):
-        if key not in self.data:
-            return defval
-        return int(self.data[key])
+    def get_warnings(self):
+        """Return warnings for options that look like misspelled known options"""
+        warnings = []
+        for key in self.data:
+            if key in OPTIONS:
+                continue
+            close = difflib.get_close_matches(key, OPTIONS, n=1, cutoff=0.8)
+            if close:
+                warnings.append("unknown option '{}' in {}, did you mean '{}'?".format(key, self.filename, close[0]))
+        return warnings
@@ -0,0 +1,146 @@
+
+import collections
+import contextlib
+import importlib
+import importlib.util
+import json
+import os
+import threading
+import time
+
+Event = collections.namedtuple('Event', 'name phase time data')
+
+class Events:
+    """Build events that plugins can subscribe to
+
+    Events are either instant ('instant' phase) or spans, sent as a
+    'start' event when they begin and an 'end' event (with the same
+    data) when they finish.  Handlers are called with an Event and can
+    subscribe to a single event name or to all events with '*'.
+
+    Events emitted by the builder:
+
+      build          (span)     one build
+      source_loaded  (instant)  sources read; data: posts, pages
+      parse          (span)     parsing of a page; data: file
+      render         (span)     rendering of a page; data: file
+      template       (span)     building of a template; data: template
+      write_file     (instant)  file written; data: file, size
+      copy_file      (instant)  file copied; data: src, file
+
+    When nobody is subscribed to an event, emitting it does nothing.
+
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.recorded = None
+
+    def subscribe(self, name, handler):
+        self.handlers.setdefault(name, []).append(handler)
+
+    def unsubscribe(self, name, handler):
+        handlers = self.handlers.get(name, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.handlers.pop(name, None)
+
+    def wants(self, name):
+        return (name in self.handlers) or ('*' in self.handlers)
+
+    def _send(self, name, phase, data):
+        event = Event(name=name, phase=phase, time=time.perf_counter(), data=data)
+        if self.recorded is not None:
+            self.recorded.append(event)
+            return
+        self._dispatch(event)
+
+    def _dispatch(self, event):
+        for handler in self.handlers.get(event.name, []) + self.handlers.get('*', []):
+            handler(event)
+
+    def start_recording(self):
+        """Keep events instead of sending them to the handlers
+
+        This is used in worker processes, whose events are sent to the
+        main process and replayed there.
+        """
+        self.recorded = []
+
+    def stop_recording(self):
+        (recorded, self.recorded) = (self.recorded, None)
+        return recorded
+
+    def replay(self, events):
+        for event in events:
+            self._dispatch(event)
+
+    def emit(self, name, **data):
+        if self.wants(name):
+            self._send(name, 'instant', data)
+
+    @contextlib.contextmanager
+    def _span(self, name, data):
+        self._send(name, 'start', data)
+        try:
+            yield
+        finally:
+            self._send(name, 'end', data)
+
+    def span(self, name, **data):
+        if not self.wants(name):
+            return contextlib.nullcontext()
+        return self._span(name, data)
+
+class ChromeTrace:
+    """Subscriber that records events in the Chrome trace event format
+
+    The trace file can be opened in chrome://tracing or Perfetto.
+
+    """
+
+    phases = { 'start': 'B', 'end': 'E', 'instant': 'i' }
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.pid = os.getpid()
+        self.trace_events = []
+
+    def attach(self, events):
+        events.subscribe('*', self.handle)
+
+    def handle(self, event):
+        trace_event = {
+            'name': event.name,
+            'cat':  'blogen',
+            'ph':   self.phases[event.phase],
+            'ts':   round((event.time - self.start_time) * 1000000, 3),
+            'pid':  self.pid,
+            'tid':  threading.get_ident(),
+        }
+        if event.phase == 'instant':
+            trace_event['s'] = 't'
+        if event.phase != 'end':
+            trace_event['args'] = { key: str(value) for key, value in event.data.items() }
+        self.trace_events.append(trace_event)
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({ 'traceEvents': self.trace_events, 'displayTimeUnit': 'ms' }, f)
+
+def load_plugin(name, builder):
+    """Load a plugin and call its setup(builder) function
+
+    The plugin can be the name of an importable module or the filename
+    of a Python file.
+    """
+    if name.endswith('.py'):
+        module_name = os.path.splitext(os.path.basename(name))[0]
+        spec = importlib.util.spec_from_file_location(module_name, name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(name)
+    module.setup(builder)
+    return module
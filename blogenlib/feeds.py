@@ -0,0 +1,49 @@
+
+import json
+import xml.sax.saxutils
+
+# maximum number of URLs in a sitemap file allowed by the protocol
+SITEMAP_MAX_URLS = 50000
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+def split_urls(urls, max_urls):
+    """Split a list of sitemap URLs in parts of at most max_urls"""
+    return [ urls[i:i+max_urls] for i in range(0, len(urls), max_urls) ] or [ [] ]
+
+def write_sitemap(out, urls):
+    """Write a sitemap with the given (url, lastmod) pairs"""
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<urlset xmlns="{}">\n'.format(SITEMAP_NS))
+    for url, lastmod in urls:
+        if lastmod:
+            out.write('  <url><loc>{}</loc><lastmod>{}</lastmod></url>\n'.format(xml.sax.saxutils.escape(url), lastmod))
+        else:
+            out.write('  <url><loc>{}</loc></url>\n'.format(xml.sax.saxutils.escape(url)))
+    out.write('</urlset>\n')
+
+def write_sitemap_index(out, sitemaps):
+    """Write a sitemap index with the given (sitemap url, lastmod) pairs"""
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<sitemapindex xmlns="{}">\n'.format(SITEMAP_NS))
+    for url, lastmod in sitemaps:
+        out.write('  <sitemap><loc>{}</loc><lastmod>{}</lastmod></sitemap>\n'.format(xml.sax.saxutils.escape(url), lastmod))
+    out.write('</sitemapindex>\n')
+
+def write_json_feed(out, feed, items):
+    """Write a JSON Feed (https://jsonfeed.org/version/1.1)
+
+    The feed dict has the top-level fields, and items can be any
+    iterable (for example, a generator producing the items as they are
+    written).
+    """
+    out.write('{\n')
+    out.write('  "version": "https://jsonfeed.org/version/1.1",\n')
+    for key, value in feed.items():
+        out.write('  {}: {},\n'.format(json.dumps(key), json.dumps(value, ensure_ascii=False)))
+    out.write('  "items": [')
+    sep = '\n'
+    for item in items:
+        out.write(sep + '    ' + json.dumps(item, ensure_ascii=False))
+        sep = ',\n'
+    out.write('\n  ]\n}\n')
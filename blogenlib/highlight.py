@@ -0,0 +1,124 @@
+
+import re
+
+import blogenlib
+
+try:
+    import pygments
+    import pygments.formatters
+    import pygments.lexers
+    import pygments.util
+except ImportError:
+    pygments = None
+
+C_KEYWORDS = [
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double',
+    'else', 'enum', 'extern', 'float', 'for', 'goto', 'if', 'inline', 'int', 'long',
+    'register', 'return', 'short', 'signed', 'sizeof', 'static', 'struct', 'switch',
+    'typedef', 'union', 'unsigned', 'void', 'volatile', 'while',
+    # C++
+    'bool', 'catch', 'class', 'constexpr', 'delete', 'false', 'namespace', 'new',
+    'nullptr', 'operator', 'private', 'protected', 'public', 'template', 'this',
+    'throw', 'true', 'try', 'typename', 'using', 'virtual',
+]
+
+PYTHON_KEYWORDS = [
+    'False', 'None', 'True', 'and', 'as', 'assert', 'async', 'await', 'break',
+    'class', 'continue', 'def', 'del', 'elif', 'else', 'except', 'finally', 'for',
+    'from', 'global', 'if', 'import', 'in', 'is', 'lambda', 'nonlocal', 'not', 'or',
+    'pass', 'raise', 'return', 'try', 'while', 'with', 'yield',
+]
+
+JS_KEYWORDS = [
+    'async', 'await', 'break', 'case', 'catch', 'class', 'const', 'continue',
+    'default', 'delete', 'do', 'else', 'export', 'extends', 'false', 'finally',
+    'for', 'function', 'if', 'import', 'in', 'instanceof', 'let', 'new', 'null',
+    'return', 'switch', 'this', 'throw', 'true', 'try', 'typeof', 'undefined',
+    'var', 'void', 'while', 'yield',
+]
+
+SH_KEYWORDS = [
+    'case', 'do', 'done', 'elif', 'else', 'esac', 'export', 'fi', 'for', 'function',
+    'if', 'in', 'local', 'return', 'then', 'until', 'while',
+]
+
+def make_lexer(keywords, comment, string, preproc=None):
+    """Make a regex matching the tokens of a language (one named group per token class)"""
+    # token classes are the same used by Pygments, so the same CSS
+    # works for both highlighters
+    parts = []
+    if preproc:
+        parts.append(r'(?P<cp>{})'.format(preproc))
+    parts.append(r'(?P<c>{})'.format(comment))
+    parts.append(r'(?P<s>{})'.format(string))
+    parts.append(r'(?P<m>\b(?:0[xX][0-9a-fA-F]+|[0-9]+(?:\.[0-9]*)?(?:[eE][+-]?[0-9]+)?)\b)')
+    parts.append(r'(?P<k>\b(?:{})\b)'.format('|'.join(keywords)))
+    return re.compile('|'.join(parts), re.MULTILINE)
+
+C_LEXER = make_lexer(C_KEYWORDS, r'//[^\n]*|/\*[\s\S]*?\*/', r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'',
+                     preproc=r'^[ \t]*#[^\n]*')
+
+class BuiltinHighlighter:
+    """Simple regex-based highlighter for a few languages"""
+
+    name = 'builtin'
+    version = '1'
+
+    lexers = {
+        'c':          C_LEXER,
+        'h':          C_LEXER,
+        'cpp':        C_LEXER,
+        'c++':        C_LEXER,
+        'python':     make_lexer(PYTHON_KEYWORDS, r'#[^\n]*',
+                                 r'"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''),
+        'javascript': make_lexer(JS_KEYWORDS, r'//[^\n]*|/\*[\s\S]*?\*/',
+                                 r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`'),
+        'sh':         make_lexer(SH_KEYWORDS, r'(?<![\w$])#[^\n]*', r'"(?:\\.|[^"\\])*"|\'[^\']*\''),
+    }
+    lexers['py'] = lexers['python']
+    lexers['js'] = lexers['javascript']
+    lexers['bash'] = lexers['sh']
+    lexers['shell'] = lexers['sh']
+
+    def highlight(self, code, language):
+        lexer = self.lexers.get(language, None)
+        if lexer is None:
+            return None
+        ret = []
+        pos = 0
+        for match in lexer.finditer(code):
+            if match.start() == match.end():
+                continue
+            ret.append(blogenlib.escape_html(code[pos:match.start()]))
+            ret.append('<span class="{}">{}</span>'.format(match.lastgroup, blogenlib.escape_html(match.group())))
+            pos = match.end()
+        ret.append(blogenlib.escape_html(code[pos:]))
+        return ''.join(ret)
+
+class PygmentsHighlighter:
+    """Highlighter using Pygments, if installed"""
+
+    name = 'pygments'
+
+    def __init__(self):
+        self.version = pygments.__version__
+        self.formatter = pygments.formatters.HtmlFormatter(nowrap=True)
+
+    def highlight(self, code, language):
+        try:
+            lexer = pygments.lexers.get_lexer_by_name(language)
+        except pygments.util.ClassNotFound:
+            return None
+        ret = pygments.highlight(code, lexer, self.formatter)
+        # Pygments adds a newline at the end
+        if ret.endswith('\n') and not code.endswith('\n'):
+            ret = ret[:-1]
+        return ret
+
+def get_highlighter(name):
+    """Return the highlighter with the given name, or None if it's not available"""
+    if name in ('', '1', 'builtin'):
+        return BuiltinHighlighter()
+    if name == 'pygments' and pygments is not None:
+        return PygmentsHighlighter()
+    return None
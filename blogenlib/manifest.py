@@ -0,0 +1,143 @@
+
+import collections
+import hashlib
+import json
+import os
+
+ManifestEntry = collections.namedtuple('ManifestEntry', 'path hash size status')
+
+class HashingWriter:
+    """Write text to a binary file as UTF-8, keeping the hash and size of the data"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha1()
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.f.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def get_hash(self):
+        return self.digest.hexdigest()
+
+class BuildManifest:
+    """Record of the files in the publish directory produced by a build
+
+    The manifest of the previous build is read from the manifest
+    directory (the publish directory if not given), so each file produced by this build can be marked as
+    'added', 'changed' or 'unchanged'.  Files present in the previous
+    manifest that were not produced by this build are marked as
+    'removed'.
+
+    Builders can also store extra information (for example, the list of
+    posts) to be compared in the next build.
+
+    """
+
+    def __init__(self, publish_dir, filename='.blogen-manifest.json', manifest_dir=None):
+        self.publish_dir = publish_dir
+        self.filename = os.path.join(manifest_dir or publish_dir, filename)
+        old_data = self.read()
+        self.old_files = old_data.get('files', {})
+        self.old_info = old_data.get('info', {})
+        self.files = {}
+        self.info = {}
+
+    def get_path(self, filename):
+        return os.path.relpath(filename, self.publish_dir).replace(os.sep, '/')
+
+    def read(self):
+        try:
+            with open(self.filename, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self):
+        data = {
+            'files': self.files,
+            'info':  self.info,
+        }
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def set_info(self, key, value):
+        self.info[key] = value
+
+    def get_old_info(self, key):
+        return self.old_info.get(key, None)
+
+    def set_deps(self, filename, deps_hash):
+        """Record the hash of everything a file depends on"""
+        self.info.setdefault('deps', {})[self.get_path(filename)] = deps_hash
+
+    def get_old_deps(self, filename):
+        return self.old_info.get('deps', {}).get(self.get_path(filename), None)
+
+    def get_old_hash(self, filename):
+        info = self.old_files.get(self.get_path(filename), None)
+        return info['hash'] if info else None
+
+    def _add(self, filename, digest, size):
+        self.files[self.get_path(filename)] = {
+            'hash': digest,
+            'size': size,
+        }
+
+    def add_data(self, filename, data):
+        """Record a file written with the given data (bytes)"""
+        self._add(filename, hashlib.sha1(data).hexdigest(), len(data))
+
+    def add_hash(self, filename, digest, size):
+        """Record a file written with data of the given hash and size"""
+        self._add(filename, digest, size)
+
+    def add_file(self, filename, src_file=None):
+        """Record a file, reading its data from the disk (from src_file, if given)"""
+        digest = hashlib.sha1()
+        size = 0
+        with open(src_file or filename, 'rb') as f:
+            while True:
+                block = f.read(65536)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+        self._add(filename, digest.hexdigest(), size)
+
+    def keep(self, filename):
+        """Record a file that was left untouched by the build"""
+        path = self.get_path(filename)
+        if path in self.old_files:
+            self.files[path] = self.old_files[path]
+        elif os.path.isfile(filename):
+            self.add_file(filename)
+
+    def get_status(self, path):
+        if path not in self.files:
+            return 'removed'
+        if path not in self.old_files:
+            return 'added'
+        if self.old_files[path]['hash'] != self.files[path]['hash']:
+            return 'changed'
+        return 'unchanged'
+
+    def get_entries(self):
+        ret = []
+        for path in sorted(set(self.files) | set(self.old_files)):
+            info = self.files[path] if path in self.files else self.old_files[path]
+            ret.append(ManifestEntry(path=path, hash=info['hash'], size=info['size'], status=self.get_status(path)))
+        return ret
+
+    def get_removed(self):
+        return [ path for path in sorted(self.old_files) if path not in self.files ]
+
+    def write_report(self, filename, delta=False):
+        """Write the list of entries as JSON, optionally only the changes"""
+        entries = [ entry._asdict() for entry in self.get_entries() if not (delta and entry.status == 'unchanged') ]
+        with open(filename, 'w') as f:
+            json.dump({ 'files': entries }, f, indent=1)
@@ -1,15 +1,10 @@
 
 import re
 
-class Element:
+import blogenlib
+import blogenlib.cache
 
-    html_quote_map = {
-        "&": "&amp;",
-        '"': "&quot;",
-        "'": "&apos;",
-        ">": "&gt;",
-        "<": "&lt;",
-    }
+class Element:
 
     def __init__(self, children = None):
         self.children = []
@@ -25,6 +20,16 @@ class Element:
     def is_block(self):
         return False
 
+    def element_contains(el, from_class):
+        if isinstance(el, from_class):
+            return True
+        if not isinstance(el, Element):
+            return False
+        for child in el.children:
+            if Element.element_contains(child, from_class):
+                return True
+        return False
+
     def element_contains_block(el):
         if not isinstance(el, Element):
             return False
@@ -47,7 +52,7 @@ class Element:
         return el
 
     def quote_html(text):
-        return "".join(Element.html_quote_map.get(c, c) for c in text)
+        return blogenlib.escape_html(text)
     
     def slashed_char(ch):
         if ch == '\\': return ch
@@ -198,10 +203,11 @@ class ImageElement(Element):
     def render(self, renderer = None):
         info = renderer.get_image_info(self.url);
         alt_one_line = self.alt.replace('\n', ' ')
+        alt_attr = Element.quote_html(alt_one_line)
         if ('width' in info) and ('height' in info):
-            img_tag = '<img width="{}" height="{}" src="{}" alt="{}" title="{}">'.format(info['width'], info['height'], info['url'], alt_one_line, alt_one_line)
+            img_tag = '<img width="{}" height="{}" src="{}" alt="{}" title="{}">'.format(info['width'], info['height'], info['url'], alt_attr, alt_attr)
         else:
-            img_tag = '<img src="{}" alt="{}" title="{}">'.format(info['url'], alt_one_line, alt_one_line)
+            img_tag = '<img src="{}" alt="{}" title="{}">'.format(info['url'], alt_attr, alt_attr)
             
         return ('<div class="image">\n  ' +
                 img_tag +
@@ -263,12 +269,14 @@ class MultilineCodeElement(Element):
         
     def render(self, renderer = None):
         header = '<div class="multiline-code-header">{}</div>\n'.format(self.header) if len(self.header) > 0 else ''
+        code = '\n'.join(self.lines[1:])
+        highlighted = renderer.highlight_code(code, self.code_type.lower()) if renderer else None
             
         return (header +
                 '<div class="multiline-code-wrapper">\n' +
                 '<div class="multiline-code">\n<pre>' +
                 #'\n'.join([ self.render_line(num, line) for num, line in enumerate(self.lines[1:]) ]) +
-                '\n'.join(self.lines[1:]) +
+                (highlighted if highlighted is not None else code) +
                 '</pre>\n</div>\n</div>')
 
     def is_block(self):
@@ -293,6 +301,8 @@ class Markdown:
 
     def __init__(self):
         self.blocks = []
+        self.block_keys = []
+        self.excerpt_end = None
 
     def get_elements(self, from_class):
         def sweep_tree(node, ret):
@@ -307,37 +317,87 @@ class Markdown:
             sweep_tree(block, ret)
         return ret
             
-    def add_block(self, el):
+    def add_block(self, el, key = None):
+        """Add a block; key identifies its source text (see Renderer.render_block)"""
         self.blocks.append(el)
-        
-    def render(self, renderer = None):
+        self.block_keys.append(key)
+
+    def mark_excerpt_end(self):
+        if self.excerpt_end is None:
+            self.excerpt_end = len(self.blocks)
+
+    def has_excerpt(self):
+        return self.excerpt_end is not None
+
+    def render_blocks(self, renderer = None):
+        if renderer is None:
+            return [ block.render(renderer) for block in self.blocks ]
         l = []
-        for block in self.blocks:
-            l.append(block.render(renderer))
-        return '\n\n'.join(l)
+        for block, key in zip(self.blocks, self.block_keys):
+            l.append(renderer.render_block(block, key))
+        return l
+
+    def render(self, renderer = None):
+        return '\n\n'.join(self.render_blocks(renderer))
+
+    def render_with_excerpt(self, renderer = None):
+        """Render to (html, excerpt_html), excerpt_html is None if there's no excerpt"""
+        l = self.render_blocks(renderer)
+        if self.excerpt_end is None:
+            return ('\n\n'.join(l), None)
+        return ('\n\n'.join(l), '\n\n'.join(l[:self.excerpt_end]))
 
 class Parser:
-    
-    def parse(self, text):
+
+    more_re = re.compile(r'<!--\s*more\s*-->')
+
+    def __init__(self, cache_blocks = True):
+        # parsed blocks, reused when the same text is parsed again
+        self.block_cache = blogenlib.cache.BlockCache(cache_blocks)
+
+    def parse(self, text, excerpt_only = False):
+        """Parse text to markdown.
+
+        A block containing only "<!-- more -->" marks the end of the
+        excerpt.  If excerpt_only is True, parsing stops there.
+        """
         markdown = Markdown()
         pos = 0
         while pos < len(text):
-            para = ParagraphElement()
             while (pos < len(text)) and (text[pos].isspace()):
                 pos += 1
             if text[pos:pos+3] == '```':
                 end_pos = text.find('```', pos+3)
-                para.add_child(MultilineCodeElement(text[pos+3:end_pos]))
+                key = ('code', text[pos+3:end_pos])
                 pos = end_pos + 3
             else:
                 end_pos = text.find('\n\n', pos)
                 if end_pos < 0:
                     end_pos = len(text)
-                para.add_children(self.parse_text(text[pos:end_pos]))
+                if Parser.more_re.fullmatch(text[pos:end_pos].strip()):
+                    markdown.mark_excerpt_end()
+                    if excerpt_only:
+                        break
+                    pos = end_pos
+                    continue
+                key = ('text', text[pos:end_pos])
                 pos = end_pos
-            markdown.add_block(para)
+            para = self.block_cache.get(key)
+            if para is None:
+                para = self.parse_block(key)
+                self.block_cache.put(key, para)
+            markdown.add_block(para, key)
         return markdown
 
+    def parse_block(self, key):
+        (block_type, text) = key
+        para = ParagraphElement()
+        if block_type == 'code':
+            para.add_child(MultilineCodeElement(text))
+        else:
+            para.add_children(self.parse_text(text))
+        return para
+
     def parse_text(self, text):
         ret = []
         pos = 0
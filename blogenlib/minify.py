@@ -0,0 +1,60 @@
+import re
+
+# start of a tag, or of an element whose content must be kept as-is
+tag_start_re = re.compile(r'<(?:(pre|textarea|script|style)\b|[a-z])', re.IGNORECASE)
+# rest of a tag, with quoted attribute values (which may contain '>')
+tag_end_re = re.compile(r'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+attr_value_re = re.compile(r'"[^"]*"|\'[^\']*\'')
+
+newline_space_re = re.compile(r'[ \t\r\f\v]*\n\s*')
+space_re = re.compile(r'[ \t\r\f\v]{2,}|[\t\r\f\v]')
+
+def collapse_whitespace(text):
+    text = newline_space_re.sub('\n', text)
+    return space_re.sub(' ', text)
+
+def collapse_tag_whitespace(tag):
+    ret = []
+    pos = 0
+    for match in attr_value_re.finditer(tag):
+        ret.append(collapse_whitespace(tag[pos:match.start()]))
+        ret.append(match.group(0))
+        pos = match.end()
+    ret.append(collapse_whitespace(tag[pos:]))
+    return ''.join(ret)
+
+def minify_html(html):
+    """Collapse insignificant whitespace in HTML
+
+    Runs of whitespace containing a newline are replaced by a single
+    newline, other runs by a single space.  The contents of <pre>,
+    <textarea>, <script> and <style> elements and quoted attribute
+    values are left untouched.  Everything after a tag or one of these
+    elements that is not closed is also left untouched, so each part
+    of the text is scanned only once.
+    """
+
+    ret = []
+    pos = 0
+    while True:
+        match = tag_start_re.search(html, pos)
+        if match is None:
+            break
+        if match.group(1):
+            end = re.compile(r'</{}\s*>'.format(match.group(1)), re.IGNORECASE).search(html, match.end())
+        else:
+            end = tag_end_re.match(html, match.end())
+        if end is None:
+            break
+        ret.append(collapse_whitespace(html[pos:match.start()]))
+        if match.group(1):
+            ret.append(html[match.start():end.end()])
+        else:
+            ret.append(collapse_tag_whitespace(html[match.start():end.end()]))
+        pos = end.end()
+    if match is None:
+        ret.append(collapse_whitespace(html[pos:]))
+    else:
+        ret.append(collapse_whitespace(html[pos:match.start()]))
+        ret.append(html[match.start():])
+    return ''.join(ret)
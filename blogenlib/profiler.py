@@ -0,0 +1,114 @@
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+class Profiler:
+    """Collect build timings
+
+    Each build phase records its wall time and CPU time, and with
+    trace_memory the memory allocated while it ran; individual items
+    (like the parsing of a post) record their wall time only.  Tracing
+    memory makes everything a lot slower, so it's only done when asked
+    for.  When disabled, the phase and item contexts do nothing.
+
+    """
+
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.phases = []
+        self.items = {}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            (start_mem, _) = tracemalloc.get_traced_memory()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            end_wall = time.perf_counter()
+            end_cpu = time.process_time()
+            phase = {
+                'name':      name,
+                'wall':      end_wall - start_wall,
+                'cpu':       end_cpu - start_cpu,
+            }
+            if self.trace_memory:
+                (end_mem, peak_mem) = tracemalloc.get_traced_memory()
+                phase['allocated'] = end_mem - start_mem
+                phase['peak'] = peak_mem - start_mem
+            self.phases.append(phase)
+
+    @contextlib.contextmanager
+    def _item(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.items.setdefault(kind, []).append((time.perf_counter() - start, name))
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._phase(name)
+
+    def item(self, kind, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._item(kind, name)
+
+    def start_recording(self):
+        """Start a new list of items, to be sent from a worker process to the main process"""
+        self.items = {}
+
+    def stop_recording(self):
+        """Return the items recorded since start_recording()"""
+        items = self.items
+        self.items = {}
+        return items
+
+    def add_items(self, items):
+        """Add items recorded by stop_recording() in a worker process"""
+        for kind, kind_items in items.items():
+            self.items.setdefault(kind, []).extend(kind_items)
+
+    def get_report(self, num_slowest=10):
+        slowest = {}
+        for kind, items in self.items.items():
+            items = sorted(items, key=lambda item: item[0], reverse=True)[:num_slowest]
+            slowest[kind] = [ { 'name': name, 'wall': wall } for wall, name in items ]
+        return {
+            'phases':  self.phases,
+            'slowest': slowest,
+        }
+
+    def format_report(self, num_slowest=10):
+        report = self.get_report(num_slowest)
+        ret = []
+        if self.trace_memory:
+            ret.append('{:<12} {:>10} {:>10} {:>12} {:>12}'.format('phase', 'wall (s)', 'cpu (s)', 'alloc (KB)', 'peak (KB)'))
+        else:
+            ret.append('{:<12} {:>10} {:>10}'.format('phase', 'wall (s)', 'cpu (s)'))
+        for phase in report['phases']:
+            if self.trace_memory:
+                ret.append('{:<12} {:>10.3f} {:>10.3f} {:>12.1f} {:>12.1f}'.format(phase['name'], phase['wall'], phase['cpu'],
+                                                                                phase['allocated'] / 1024, phase['peak'] / 1024))
+            else:
+                ret.append('{:<12} {:>10.3f} {:>10.3f}'.format(phase['name'], phase['wall'], phase['cpu']))
+        for kind, items in report['slowest'].items():
+            ret.append('')
+            ret.append('slowest {}:'.format(kind))
+            for item in items:
+                ret.append('  {:>10.4f}  {}'.format(item['wall'], item['name']))
+        return '\n'.join(ret)
+
+    def write_report(self, filename, num_slowest=10):
+        with open(filename, 'w') as f:
+            json.dump(self.get_report(num_slowest), f, indent=1)
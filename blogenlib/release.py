@@ -0,0 +1,104 @@
+
+import datetime
+import os
+import shutil
+
+def link_tree(src_dir, dest_dir):
+    """Make a copy of a directory tree with hard links to the files
+
+    Dotfiles (build state like the manifest, which is written over) are
+    copied instead.  Files are also copied when hard links are not
+    possible.  Modification times are kept, so incremental builds work
+    in the copy as they would in the original.
+    """
+    for root, dirs, files in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        os.makedirs(dest_root, exist_ok=True)
+        for name in files:
+            src = os.path.join(root, name)
+            dest = os.path.join(dest_root, name)
+            if not name.startswith('.'):
+                try:
+                    os.link(src, dest)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(src, dest)
+
+class Releases:
+    """Releases of the publish dir, for staged builds
+
+    The publish dir is a symlink to the current release, a directory
+    in the releases dir.  A build goes to a new release, which starts
+    with hard links to the files of the current one, and the symlink is
+    switched to it only when the build is done.
+
+    """
+
+    def __init__(self, publish_link, releases_dir, keep):
+        self.publish_link = publish_link.rstrip(os.sep)
+        self.releases_dir = releases_dir
+        self.keep = max(keep, 1)
+
+    def get_current(self):
+        """Return the directory of the current release, or None if there's none"""
+        if os.path.islink(self.publish_link) and os.path.isdir(self.publish_link):
+            return os.path.realpath(self.publish_link)
+        return None
+
+    def get_release_list(self):
+        """Return the release directories, oldest first"""
+        try:
+            names = sorted(os.listdir(self.releases_dir))
+        except FileNotFoundError:
+            return []
+        return [ os.path.join(self.releases_dir, name) for name in names if not name.startswith('.') ]
+
+    def _make_release_dir(self):
+        name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        release_dir = os.path.join(self.releases_dir, name)
+        os.makedirs(release_dir)
+        return release_dir
+
+    def _switch_link(self, release_dir):
+        target = os.path.relpath(release_dir, os.path.dirname(os.path.abspath(self.publish_link)))
+        tmp_link = self.publish_link + '.tmp-link'
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(target, tmp_link)
+        # rename() replaces the old symlink atomically
+        os.replace(tmp_link, self.publish_link)
+
+    def stage(self):
+        """Create a new release with the files of the current one, returning its directory"""
+        if os.path.isdir(self.publish_link) and not os.path.islink(self.publish_link):
+            # first staged build: the publish dir becomes the first release
+            first_release = self._make_release_dir()
+            os.rmdir(first_release)
+            os.rename(self.publish_link, first_release)
+            self._switch_link(first_release)
+        current = self.get_current()
+        release_dir = self._make_release_dir()
+        if current:
+            link_tree(current, release_dir)
+        return release_dir
+
+    def activate(self, release_dir):
+        """Make a release the current one"""
+        self._switch_link(release_dir)
+
+    def discard(self, release_dir):
+        """Remove a release that was not activated (for example, after a failed build)"""
+        shutil.rmtree(release_dir, ignore_errors=True)
+
+    def prune(self):
+        """Remove the oldest releases, keeping the current one; returns the list of removed directories"""
+        current = self.get_current()
+        releases = self.get_release_list()
+        removed = []
+        for release_dir in releases[:max(len(releases) - self.keep, 0)]:
+            if current and os.path.realpath(release_dir) == current:
+                continue
+            shutil.rmtree(release_dir, ignore_errors=True)
+            removed.append(release_dir)
+        return removed
@@ -1,9 +1,12 @@
 
+import html
 import os
 import re
 import PIL.Image
 
 import blogenlib
+import blogenlib.cache
+import blogenlib.highlight
 
 class Renderer:
     """Markdown renderer
@@ -15,11 +18,64 @@ class Renderer:
 
     """
 
-    def __init__(self, cfg, src, copy_files):
+    def __init__(self, cfg, src, copy_files, build_cache=None, shared=None, cache_blocks=True):
         self.cfg = cfg
+        self.conf = cfg.snapshot()
         self.src = src
         self.copy_files = copy_files
+        self.build_cache = build_cache
         self.image_cache = {}
+        # image sizes (by file) and highlighted code can be shared with
+        # renderers of other sites (see blogenlib.cache.SharedCaches)
+        self.image_sizes = shared.image_sizes if shared else {}
+        self.highlight_cache = shared.highlighted if shared else {}
+        self.block_cache = blogenlib.cache.BlockCache(cache_blocks)
+        self.highlighter = None
+        if self.conf.highlight_code:
+            self.highlighter = blogenlib.highlight.get_highlighter(self.conf.highlight_code)
+            if self.highlighter is None:
+                print("* WARNING: highlighter '{}' not available, using the builtin one".format(self.conf.highlight_code))
+                self.highlighter = blogenlib.highlight.BuiltinHighlighter()
+
+    def set_source(self, src):
+        self.src = src
+
+    def clear_image_cache(self):
+        self.image_cache = {}
+
+    def set_highlighter(self, highlighter):
+        """Set the code highlighter (an object with name, version and highlight(code, language))"""
+        self.highlighter = highlighter
+        self.highlight_cache = {}
+        self.block_cache.clear()
+
+    def get_highlighter_id(self):
+        if self.highlighter is None:
+            return ''
+        return '{} {}'.format(self.highlighter.name, self.highlighter.version)
+
+    def _highlight(self, code, language):
+        # code is copied as is (so it might contain HTML entities) when
+        # the highlighter doesn't know the language
+        text = html.unescape(code)
+        return self.highlighter.highlight(text, language)
+
+    def highlight_code(self, code, language):
+        """Return the HTML of a code block, or None if it should be used as is"""
+        if self.highlighter is None:
+            return None
+        key = blogenlib.cache.make_key('highlight', self.get_highlighter_id(), language, code)
+        if key in self.highlight_cache:
+            return self.highlight_cache[key]
+        entry = self.build_cache.get_json('highlight', key) if self.build_cache else None
+        if entry is not None:
+            ret = entry['html']
+        else:
+            ret = self._highlight(code, language)
+            if self.build_cache:
+                self.build_cache.put_json('highlight', key, { 'html': ret })
+        self.highlight_cache[key] = ret
+        return ret
 
     def _parse_command_args(self, txt):
         ret = []
@@ -62,7 +118,7 @@ class Renderer:
         post_name = args[0]
         post = self.src.get_post(post_name)
         if post is None:
-            return self._cmd_error('post_link: post "{}" not found'.format(post_name))
+            return self._cmd_error('post_link: post "{}" not found'.format(blogenlib.markdown.Element.quote_html(post_name)))
         link_url = post.get_publish_url()
         link_text = args[1] if (len(args) > 1) else post.get_title()
         return '<a href="{}">{}</a>'.format(link_url, link_text)
@@ -72,7 +128,7 @@ class Renderer:
         if len(args) == 0:
             return self._cmd_error('_cmd_tag_archive_link command must be given a tag name')
         tag_name = args[0]
-        link_url = blogenlib.url_join(self.cfg.v.publish_url, 'tags', tag_name)
+        link_url = blogenlib.url_join(self.conf.publish_url, 'tags', tag_name)
         link_text = args[1] if len(args) > 1 else link_url
         return '<a href="{}">{}</a>'.format(link_url, link_text)
 
@@ -117,14 +173,10 @@ class Renderer:
         # read the image dimensions
         src_file = os.path.join(page.get_source_dir(), filename)
         dst_file = os.path.join(page.get_publish_dir(), filename)
-        try:
-            with PIL.Image.open(src_file) as img:
-                width, height = img.size
-                ret['width'] = str(width)
-                ret['height'] = str(height)
-        except:
-            # ignore errors reading image (might be an unknown file format)
-            pass
+        size = self._get_image_size(src_file)
+        if size:
+            ret['width'] = str(size[0])
+            ret['height'] = str(size[1])
 
         # add file to the list of files to publish
         self.copy_files.add(src_file, dst_file)
@@ -132,7 +184,59 @@ class Renderer:
         self.image_cache[url] = ret
         return ret
 
+    def _read_image_size(self, src_file):
+        try:
+            with PIL.Image.open(src_file) as img:
+                return list(img.size)
+        except:
+            # ignore errors reading image (might be an unknown file format)
+            return None
+
+    def _get_image_size(self, src_file):
+        try:
+            key = blogenlib.cache.get_file_key(src_file)
+        except OSError:
+            return None
+        if key not in self.image_sizes:
+            self.image_sizes[key] = self._get_image_size_uncached(src_file)
+        return self.image_sizes[key]
+
+    def _get_image_size_uncached(self, src_file):
+        if self.build_cache is None:
+            return self._read_image_size(src_file)
+        try:
+            key = blogenlib.cache.make_key('image', blogenlib.cache.hash_file(src_file))
+        except OSError:
+            return None
+        info = self.build_cache.get_json('image', key)
+        if info is not None:
+            return info['size']
+        size = self._read_image_size(src_file)
+        self.build_cache.put_json('image', key, { 'size': size })
+        return size
+
+    def render_block(self, block, key):
+        """Render a markdown block, reusing the HTML of a block with the same source
+
+        Blocks with commands or images are always rendered, since their
+        HTML depends on other posts or on image files.
+        """
+        if key is None:
+            return block.render(self)
+        html = self.block_cache.get(key)
+        if html is not None:
+            return html
+        html = block.render(self)
+        if not blogenlib.markdown.Element.element_contains(block, (blogenlib.markdown.CommandElement,
+                                                                    blogenlib.markdown.ImageElement)):
+            self.block_cache.put(key, html)
+        return html
+
     def render(self, markdown):
         """Render the markdown to HTML."""
         return markdown.render(self)
+
+    def render_with_excerpt(self, markdown):
+        """Render the markdown to HTML, returning (html, excerpt_html)."""
+        return markdown.render_with_excerpt(self)
         
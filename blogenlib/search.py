@@ -0,0 +1,95 @@
+
+import hashlib
+import json
+import os
+import re
+
+tag_re = re.compile(r'<[^>]*>')
+entity_re = re.compile(r'&[a-z]+;|&#[0-9]+;')
+term_re = re.compile(r'\w{2,}')
+
+def extract_terms(text):
+    """Return the sorted list of distinct search terms of a text (HTML is allowed)"""
+    text = entity_re.sub(' ', tag_re.sub(' ', text))
+    return sorted(set(term.lower() for term in term_re.findall(text)))
+
+def get_shard_name(term):
+    """Terms are split in shards by their first character"""
+    c = term[0]
+    if ('a' <= c <= 'z') or ('0' <= c <= '9'):
+        return c
+    return '_'
+
+class SearchIndex:
+    """Inverted index for client-side search
+
+    The index is written as a post table (search/posts.json, with the
+    URL, title and date of each post, the position in the list being
+    the post id) and one file per shard (search/index-X.json, mapping
+    each term starting with X to the list of post ids containing it).
+
+    Terms of each post are kept together with a hash of the post
+    contents, so unchanged posts don't need to be processed again.  The
+    terms of the last build are given as old_terms or read from a state
+    file (which is not written if state_filename is None).
+
+    """
+
+    def __init__(self, state_filename, old_terms=None, post_index_hash=''):
+        self.state_filename = state_filename
+        self.post_index_hash = post_index_hash
+        self.old_terms = old_terms if old_terms is not None else self.read_state()
+        self.terms = {}
+
+    def read_state(self):
+        if self.state_filename is None:
+            return {}
+        try:
+            with open(self.state_filename, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write_state(self):
+        if self.state_filename is None:
+            return
+        os.makedirs(os.path.dirname(self.state_filename), exist_ok=True)
+        with open(self.state_filename, 'w') as f:
+            json.dump(self.terms, f, separators=(',', ':'), sort_keys=True)
+
+    def get_post_hash(self, post):
+        # commands like post_link render titles of other posts
+        post_index_hash = self.post_index_hash if '{%' in post.get_text() else ''
+        text = '\n'.join([ post.get_title(), ' '.join(post.get_tags()), post_index_hash, post.get_text() ])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def add_post(self, post, get_html):
+        """Add a post, calling get_html(post) only if the post changed since the last build"""
+        name = post.get_name()
+        post_hash = self.get_post_hash(post)
+        old = self.old_terms.get(name, None)
+        if (old is not None) and (old['hash'] == post_hash):
+            self.terms[name] = old
+            return
+        terms = extract_terms(' '.join([ post.get_title(), ' '.join(post.get_tags()), get_html(post) ]))
+        self.terms[name] = { 'hash': post_hash, 'terms': terms }
+
+    def add_terms(self, terms):
+        """Add terms of posts from another index (for example, of a shard)"""
+        self.terms.update(terms)
+
+    def get_files(self, post_list, post_url):
+        """Return a dict of the index files (relative filename to content)"""
+        posts = []
+        shards = {}
+        for post_id, post in enumerate(post_list):
+            posts.append([ post_url(post), post.get_title(), post.get_date() ])
+            for term in self.terms[post.get_name()]['terms']:
+                shards.setdefault(get_shard_name(term), {}).setdefault(term, []).append(post_id)
+        files = {
+            'posts.json': json.dumps(posts, separators=(',', ':')),
+        }
+        files['shards.json'] = json.dumps(sorted(shards), separators=(',', ':'))
+        for shard, terms in shards.items():
+            files['index-{}.json'.format(shard)] = json.dumps(terms, separators=(',', ':'), sort_keys=True)
+        return files
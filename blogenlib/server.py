@@ -0,0 +1,225 @@
+
+import collections
+import http.server
+import mimetypes
+import os
+import re
+import time
+import urllib.parse
+
+import blogenlib
+import blogenlib.watcher
+
+class PreviewSite:
+    """Render blog pages on demand from their publish paths
+
+    Nothing is written to the publish directory: pages are built only
+    when requested, and the most recently used ones are kept in an
+    LRU cache.  Sources and assets are checked for changes (at most
+    once every check_interval seconds) before answering a request, and
+    everything is prepared again if any changed.
+
+    """
+
+    def __init__(self, builder, cache_size=256, check_interval=0.5):
+        self.builder = builder
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.check_interval = check_interval
+        self.last_check = None
+        self.watcher = None
+        self.search_files = None
+
+    def prepare(self):
+        builder = self.builder
+        if self.watcher is None:
+            self.watcher = blogenlib.watcher.PollingWatcher([ builder.conf.source_dir, builder.conf.assets_dir ])
+        builder.prepare()
+        # pages kept from before the change are rendered again if they
+        # depend on something that changed
+        for page in builder.src.get_page_list():
+            if (page.get_html() is not None) and builder._page_needs_render(page):
+                builder._render_page(page)
+        self.cache.clear()
+        self.search_files = None
+        self.last_check = time.monotonic()
+
+    def check_changes(self):
+        """Prepare everything again if any source or asset changed"""
+        if time.monotonic() - self.last_check < self.check_interval:
+            return
+        self.last_check = time.monotonic()
+        changed = self.watcher.get_changes()
+        if not changed:
+            return
+        tpl_dir = os.path.join(self.builder.conf.assets_dir, 'tpl') + os.sep
+        if any(os.path.abspath(filename).startswith(tpl_dir) for filename in changed):
+            self.builder.invalidate_templates()
+        self.prepare()
+
+    def get_path(self, url_path):
+        """Convert a request path to a path relative to the publish dir"""
+        path = urllib.parse.unquote(urllib.parse.urlsplit(url_path).path)
+        prefix = blogenlib.url_join(self.builder.conf.publish_url, '/').rstrip('/')
+        if prefix and (path == prefix or path.startswith(prefix + '/')):
+            path = path[len(prefix):]
+        elif prefix:
+            return None
+        path = path.strip('/')
+        if path == '':
+            return 'index.html'
+        if '.' not in path.rsplit('/', 1)[-1]:
+            path += '/index.html'
+        return path
+
+    def _find_list_page(self, plist, path):
+        for out_file, posts, page_nav in self.builder._get_post_list_pages(plist.post_list, plist.num_posts_in_page, plist.page_filenames):
+            if out_file == path:
+                return self.builder._make_post_list_page(posts, plist.tpl_name, page_nav, extra_vars=plist.extra_vars)
+        return None
+
+    def _render(self, path):
+        builder = self.builder
+        src = builder.src
+        conf = builder.conf
+
+        if path == 'atom.xml':
+            if not conf.build_atom:
+                return None
+            return builder._make_atom_feed()
+
+        if path == 'feed.json':
+            if not conf.build_json_feed:
+                return None
+            return builder._make_json_feed()
+
+        if re.fullmatch(r'sitemap(-\d+)?\.xml', path):
+            if not conf.build_sitemap:
+                return None
+            return builder._make_sitemap(path)
+
+        match = re.fullmatch(r'search/([^/]+\.json)', path)
+        if match:
+            if not conf.build_search:
+                return None
+            if self.search_files is None:
+                self.search_files = builder._make_search_files()
+            return self.search_files.get(match.group(1), None)
+
+        match = re.fullmatch(r'(index|page\d+)\.html', path)
+        if match:
+            return self._find_list_page(builder._get_index_post_list(), path)
+
+        match = re.fullmatch(r'archives/(index|page\d+)\.html', path)
+        if match:
+            if not conf.build_archives:
+                return None
+            return self._find_list_page(builder._get_archive_post_list(), path)
+
+        match = re.fullmatch(r'archives/(\d+)/(\d+)/(index|page\d+)\.html', path)
+        if match:
+            month = '{}-{}'.format(match.group(1), match.group(2))
+            if (not conf.build_months) or (month not in src.get_month_list()):
+                return None
+            return self._find_list_page(builder._get_month_post_list(month), path)
+
+        match = re.fullmatch(r'tags/([^/]+)/(index|page\d+)\.html', path)
+        if match:
+            tag = match.group(1)
+            if (not conf.build_tags) or (tag not in src.get_tag_list()):
+                return None
+            return self._find_list_page(builder._get_tag_post_list(tag), path)
+
+        match = re.fullmatch(r'(\d+)/(\d+)/(\d+)/([^/]+)/index\.html', path)
+        if match:
+            post = src.get_post(match.group(4))
+            if (post is None) or (post.get_publish_url() != builder.get_publish_url(path[:-len('/index.html')])):
+                return None
+            return builder._make_post_page(post)
+
+        match = re.fullmatch(r'([^/]+)/index\.html', path)
+        if match:
+            page = src.get_single_page(match.group(1))
+            if page is None:
+                return None
+            return builder._make_single_page(page, 'single_page')
+
+        return None
+
+    def _read_static_file(self, path):
+        publish_file = self.builder.get_publish_file(path)
+        copy_file = self.builder.copy_files.files.get(publish_file, None)
+        if (copy_file is None) and ('/' in path):
+            # page images are only known after the page is rendered
+            self._render(path.rsplit('/', 1)[0] + '/index.html')
+            copy_file = self.builder.copy_files.files.get(publish_file, None)
+        if copy_file is None:
+            return None
+        try:
+            with open(copy_file.src, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, url_path):
+        """Return (content_type, data) for a request path, or None if not found"""
+        path = self.get_path(url_path)
+        if path is None:
+            return None
+        self.check_changes()
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+
+        content = self._render(path)
+        if content is not None:
+            data = content.encode('utf-8')
+        else:
+            data = self._read_static_file(path)
+            if data is None:
+                return None
+        if path.endswith('.html'):
+            content_type = 'text/html; charset=utf-8'
+        elif path == 'atom.xml':
+            content_type = 'application/atom+xml; charset=utf-8'
+        elif path.endswith('.xml'):
+            content_type = 'application/xml; charset=utf-8'
+        elif path == 'feed.json':
+            content_type = 'application/feed+json; charset=utf-8'
+        else:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        self.cache[path] = (content_type, data)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return self.cache[path]
+
+class PreviewRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    site = None
+    verbose = False
+
+    def do_GET(self):
+        try:
+            result = self.site.get(self.path)
+        except Exception as e:
+            self.send_error(500, 'error building page: {}'.format(e))
+            return
+        if result is None:
+            self.send_error(404)
+            return
+        (content_type, data) = result
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def serve(site, host, port, verbose=False):
+    handler = type('Handler', (PreviewRequestHandler,), { 'site': site, 'verbose': verbose })
+    with http.server.HTTPServer((host, port), handler) as server:
+        server.serve_forever()
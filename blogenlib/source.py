@@ -1,22 +1,29 @@
 
 import collections
+import hashlib
+import heapq
+import json
 import re
 import os
 import pathlib
 
-import blogenlib
-
 PostDateTime = collections.namedtuple('PostDateTime', 'date time year month day hour minute second')
 
 class Page:
 
-    def __init__(self, filename, cfg):
+    def __init__(self, filename, conf):
         self.source_filename = filename
         self.source_dir = os.path.dirname(filename)
         self.name = os.path.basename(self.source_dir)
-        self.publish_dir = os.path.join(cfg.v.publish_dir, self.name)
-        self.publish_url = blogenlib.url_join(cfg.v.publish_url, self.name)
+        self.publish_dir = os.path.join(conf.publish_dir, self.name)
+        self.publish_url = conf.publish_url_prefix + self.name
         self.mtime = os.stat(filename).st_mtime
+        self.html = None
+        self.excerpt_html = None
+        self.excerpt = False
+        self.uses_commands = False
+        self.images = []
+        self.source_hash = None
         self.read(filename)
 
     def get_name(self):
@@ -40,6 +47,12 @@ class Page:
     def get_text(self):
         return self.text
 
+    def get_source_hash(self):
+        """Return a hash of the header and text of the page"""
+        if self.source_hash is None:
+            self.source_hash = hashlib.sha1((json.dumps(self.header) + '\n' + self.text).encode('utf-8')).hexdigest()
+        return self.source_hash
+
     def get_title(self):
         return self.header['title']
 
@@ -55,8 +68,25 @@ class Page:
     def get_time(self):
         return self.header['date_time'].time
 
-    def set_html(self, html):
+    def get_sort_key(self):
+        # the name breaks ties, so the order doesn't depend on the order files are read
+        return (self.header['date_time'].date, self.header['date_time'].time, self.name)
+
+    def set_html(self, html, uses_commands=False, images=(), excerpt_html=None):
         self.html = html
+        self.uses_commands = uses_commands
+        self.images = list(images)
+        self.set_excerpt_html(excerpt_html if excerpt_html is not None else html, excerpt_html is not None)
+
+    def set_excerpt_html(self, html, excerpt=True):
+        self.excerpt_html = html
+        self.excerpt = excerpt
+
+    def get_excerpt_html(self):
+        return self.excerpt_html
+
+    def has_excerpt(self):
+        return self.excerpt
 
     def get_html(self):
         return self.html
@@ -154,16 +184,17 @@ class Page:
 
 class Post(Page):
 
-    def __init__(self, filename, cfg):
-        Page.__init__(self, filename, cfg)
-        self.cfg = cfg
+    def __init__(self, filename, conf):
+        Page.__init__(self, filename, conf)
         self.source_dir = filename[:-3]  # strip '.md' from end
         self.name = os.path.basename(self.source_dir)
         pdt = self.get_date_time()
-        self.publish_dir = os.path.join(self.cfg.v.publish_dir, pdt.year, pdt.month, pdt.day, self.get_name())
-        self.publish_url = blogenlib.url_join(self.cfg.v.publish_url, pdt.year, pdt.month, pdt.day, self.get_name())
+        self.publish_dir = os.path.join(conf.publish_dir, pdt.year, pdt.month, pdt.day, self.name)
+        self.publish_url = '{}{}/{}/{}/{}'.format(conf.publish_url_prefix, pdt.year, pdt.month, pdt.day, self.name)
         self.newer_post = None
         self.older_post = None
+        self.siblings_set = False
+        self.siblings_changed = False
 
     def get_newer_post(self):
         return self.newer_post
@@ -172,13 +203,29 @@ class Post(Page):
         return self.older_post
 
     def set_sibling_posts(self, older, newer):
+        # when a post is reused from a previous Source, remember if
+        # its siblings changed, since the post page links to them
+        def sibling_key(post):
+            return (post.get_publish_url(), post.get_title()) if post else None
+        if self.siblings_set:
+            self.siblings_changed = ((sibling_key(self.older_post), sibling_key(self.newer_post)) !=
+                                     (sibling_key(older), sibling_key(newer)))
+        self.siblings_set = True
         self.older_post = older
         self.newer_post = newer
     
 class Source:
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, old_source=None):
+        """Read the blog sources.
+
+        If old_source is given, pages whose source file didn't change
+        are reused from it instead of being read again.
+        """
         self.cfg = cfg
+        self.conf = cfg.snapshot()
+        self.old_pages = old_source.page_by_filename if old_source else {}
+        self.page_by_filename = {}
 
         self.page_list = []
         self.page_map = {}
@@ -199,8 +246,13 @@ class Source:
         self.single_page_map = {}
 
         self.last_post_mtime = 0
+
+        self.num_related_posts = self.conf.related_posts
+        self.related_posts = {}
         
         self.read()
+        self._compute_related_posts(old_source)
+        self.old_pages = {}
         
     def dump(self):
         ret = []
@@ -254,10 +306,55 @@ class Source:
 
     def get_last_post_mtime(self):
         return self.last_post_mtime
+
+    def get_related_posts(self, post):
+        return [ self.post_map[name] for name in self.related_posts.get(post.get_name(), []) ]
+
+    def _find_related_posts(self, post):
+        # count the tags shared with each post, using the tag lists as
+        # an inverted index so only posts sharing some tag are visited
+        scores = collections.Counter()
+        for tag in post.get_tags():
+            for other in self.posts_by_tag[tag]:
+                if other is not post:
+                    scores[other] += 1
+        best = heapq.nlargest(self.num_related_posts, scores.items(),
+                              key=lambda item: (item[1], item[0].get_sort_key()))
+        return [ other.get_name() for other, score in best ]
+
+    def _compute_related_posts(self, old_source):
+        if self.num_related_posts <= 0:
+            return
+        if (old_source is None) or (old_source.num_related_posts != self.num_related_posts):
+            for post in self.post_list:
+                self.related_posts[post.get_name()] = self._find_related_posts(post)
+            return
+
+        # only posts sharing tags with changed posts need to be updated
+        changed_tags = set()
+        for post in self.post_list:
+            if old_source.post_map.get(post.get_name(), None) is not post:
+                changed_tags.update(post.get_tags())
+        for name, old_post in old_source.post_map.items():
+            if self.post_map.get(name, None) is not old_post:
+                changed_tags.update(old_post.get_tags())
+        for post in self.post_list:
+            name = post.get_name()
+            if (name in old_source.related_posts) and changed_tags.isdisjoint(post.get_tags()):
+                self.related_posts[name] = old_source.related_posts[name]
+            else:
+                self.related_posts[name] = self._find_related_posts(post)
     
+    def _get_old_page(self, filename):
+        page = self.old_pages.get(filename, None)
+        if (page is not None) and (page.get_mtime() == os.stat(filename).st_mtime):
+            return page
+        return None
+
     def _add_page(self, page):
         self.page_map[page.get_name()] = page
         self.page_list.append(page)
+        self.page_by_filename[page.get_source_filename()] = page
 
     def _add_single_page(self, page):
         self._add_page(page)
@@ -301,14 +398,14 @@ class Source:
             self.posts_by_tag[tag].add(post)
 
     def _read_posts(self):
-        posts_source_dir = os.path.join(self.cfg.v.source_dir, '_posts')
+        posts_source_dir = os.path.join(self.conf.source_dir, '_posts')
         for name in os.listdir(posts_source_dir):
             filename = os.path.join(posts_source_dir, name)
             if filename.endswith('.md') and os.path.isfile(filename):
-                self._add_post(Post(filename, self.cfg))
+                self._add_post(self._get_old_page(filename) or Post(filename, self.conf))
 
         # sort list and mark siblings
-        self.post_list.sort(reverse=True, key=lambda post: post.get_date())
+        self.post_list.sort(reverse=True, key=lambda post: post.get_sort_key())
         for num, post in enumerate(self.post_list):
             older = self.post_list[num+1] if num+1 < len(self.post_list) else None
             newer = self.post_list[num-1] if num > 0 else None
@@ -318,13 +415,13 @@ class Source:
         self.tag_list = sorted(self.tag_set)
 
     def _read_single_pages(self):
-        for name in os.listdir(self.cfg.v.source_dir):
+        for name in os.listdir(self.conf.source_dir):
             if name.startswith('_'):
                 continue
-            filename = os.path.join(self.cfg.v.source_dir, name, 'index.md')
+            filename = os.path.join(self.conf.source_dir, name, 'index.md')
             if not os.path.exists(filename):
                 continue
-            page = Page(filename, self.cfg)
+            page = self._get_old_page(filename) or Page(filename, self.conf)
             self._add_single_page(page)
         
     def read(self):
@@ -1,13 +1,23 @@
 
 import re
 import os.path
+import json
+import hashlib
+import types
 
-def replace_vars(txt, data):
+import blogenlib
+
+var_re = re.compile(r'\$(?:if|raw)?\{([a-z0-9_]+)')
+
+def replace_vars(txt, data, escape=None):
+    """Replace ${var} in the text, escaping values with escape() unless written as $raw{var}"""
     def repl_data(match):
-        var = match.group(1)
-        if var in data:
-            return data[var]
-        return ''
+        var = match.group(2)
+        if var not in data:
+            return ''
+        if (escape is not None) and (match.group(1) is None):
+            return escape(data[var])
+        return data[var]
     
     def repl_if(match):
         var = match.group(1)
@@ -19,15 +29,15 @@ def replace_vars(txt, data):
             return text_if_false
         
     txt = re.sub(r'\$if\{([a-z0-9_]+):([^:\}]*):([^:\}]*)\}', repl_if, txt)
-    txt = re.sub(r'\$\{([a-z0-9_]+)\}', repl_data, txt)
+    txt = re.sub(r'\$(raw)?\{([a-z0-9_]+)\}', repl_data, txt)
     return txt
 
 class Element:
 
-    def build_elements(collector, els, data):
+    def build_elements(collector, els, data, escape=None):
         for el in els:
             if isinstance(el, str):
-                collector.append(replace_vars(el, data))
+                collector.append(replace_vars(el, data, escape))
             else:
                 el.build(collector, data)
     
@@ -35,6 +45,7 @@ class Element:
         self.name = name
         self.line = line
         self.children = []
+        self.escape = None
 
     def add_child(self, child):
         #if (len(self.children) > 0) and isinstance(child, str) and isinstance(self.children[-1], str):
@@ -43,7 +54,20 @@ class Element:
         self.children.append(child)
 
     def build(self, collector, data):
-        Element.build_elements(collector, self.children, data)
+        Element.build_elements(collector, self.children, data, self.escape)
+
+    def get_vars(self):
+        """Return the set of variables used by the element, or None if unknown"""
+        ret = set()
+        for el in self.children:
+            if isinstance(el, str):
+                ret.update(var_re.findall(el))
+                continue
+            el_vars = el.get_vars()
+            if el_vars is None:
+                return None
+            ret |= el_vars
+        return ret
 
 class DocumentElement(Element):
 
@@ -59,21 +83,90 @@ class IncludeElement(Element):
 
     def build(self, collector, data):
         collector.append(self.tpl_proc.build(self.tpl_name, data))
+
+    def get_vars(self):
+        return None
     
+class CachedItem:
+    """Item of a foreach list whose output can be cached
+
+    The key must identify the values returned by get_vars(), which is
+    only called when the output of the item is not in the cache.
+    """
+
+    def __init__(self, key, get_vars):
+        self.key = key
+        self.get_vars = get_vars
+
 class ForeachElement(Element):
 
-    def __init__(self, line, var):
+    def __init__(self, line, var, tpl_name=None, tpl_proc=None):
         Element.__init__(self, 'foreach', line);
         self.var = var
+        self.tpl_name = tpl_name
+        self.tpl_proc = tpl_proc
+        self.body_vars = False
+
+    def get_vars(self):
+        body_vars = Element.get_vars(self)
+        if body_vars is None:
+            return None
+        return body_vars | { self.var }
+
+    def get_fragment_key(self, item, data):
+        # the output of an item depends on the item and on the
+        # variables from outside the loop used in the body
+        if self.body_vars is False:
+            self.body_vars = Element.get_vars(self)
+        if self.body_vars is None:
+            return None
+        outer = [ [ var, data[var] ] for var in sorted(self.body_vars) if var in data ]
+        try:
+            outer = json.dumps(outer)
+        except TypeError:
+            return None
+        return (self.tpl_proc.get_tpl_hash(self.tpl_name), str(self.line), item.key, outer)
+
+    def build_cached_item(self, collector, data, item):
+        cache = self.tpl_proc.fragment_cache
+        key = self.get_fragment_key(item, data) if cache is not None else None
+        fragment = cache.get(key) if key is not None else None
+        if fragment is None:
+            sub_data = data.copy()
+            sub_data.update(item.get_vars())
+            pieces = []
+            Element.build(self, pieces, sub_data)
+            fragment = { 'text': '\n'.join(pieces) if pieces else None }
+            if key is not None:
+                cache.put(key, fragment)
+        if fragment['text'] is not None:
+            collector.append(fragment['text'])
 
     def build(self, collector, data):
-        if (self.var not in data) or (not isinstance(data[self.var], list)):
+        # lists or generators (for long lists built while being written)
+        if (self.var not in data) or (not isinstance(data[self.var], (list, types.GeneratorType))):
             return
         for item in data[self.var]:
+            if isinstance(item, CachedItem):
+                self.build_cached_item(collector, data, item)
+                continue
             sub_data = data.copy()
             sub_data.update(item)
             Element.build(self, collector, sub_data)
 
+class StreamCollector:
+    """Collector that writes the pieces of a template to a file"""
+
+    def __init__(self, out):
+        self.out = out
+        self.first = True
+
+    def append(self, text):
+        if not self.first:
+            self.out.write('\n')
+        self.first = False
+        self.out.write(text)
+
 class IfElementCondition:
 
     def __init__(self, test):
@@ -102,17 +195,62 @@ class IfElement(Element):
         Element.add_child(self, child)
         self.conds[-1].add_child(child)
 
+    def get_vars(self):
+        body_vars = Element.get_vars(self)
+        if body_vars is None:
+            return None
+        return body_vars | set(cond.test for cond in self.conds)
+
     def build(self, collector, data):
         for cond in self.conds:
             if cond.run_test(data):
-                Element.build_elements(collector, cond.children, data)
+                Element.build_elements(collector, cond.children, data, self.escape)
                 return
 
 class TemplateProcessor:
+    """Build pages from templates
+
+    With autoescape, values of ${var} are HTML-escaped; values that
+    are HTML (like post_content) must be written as $raw{var}.
+    """
 
-    def __init__(self, tpl_dir):
+    def __init__(self, tpl_dir, autoescape=False):
         self.tpl_dir = tpl_dir
+        self.escape = blogenlib.escape_html if autoescape else None
         self.cache = {}
+        self.compiled = {}
+        self.used_vars = {}
+        self.tpl_hashes = {}
+        self.fragment_cache = None
+
+    def clear_cache(self):
+        self.cache = {}
+        self.compiled = {}
+        self.used_vars = {}
+        self.tpl_hashes = {}
+
+    def get_tpl_hash(self, tpl_name):
+        if tpl_name not in self.tpl_hashes:
+            digest = hashlib.sha1(self.read_tpl(tpl_name).encode('utf-8'))
+            digest.update(b'autoescape' if self.escape else b'')
+            self.tpl_hashes[tpl_name] = digest.hexdigest()
+        return self.tpl_hashes[tpl_name]
+
+    def uses_var(self, tpl_name, var):
+        """Check if a template or any template it includes uses a variable"""
+        key = (tpl_name, var)
+        if key in self.used_vars:
+            return self.used_vars[key]
+        txt = self.read_tpl(tpl_name)
+        used = ((re.search(r'\$(if|raw)?\{' + re.escape(var) + r'[:\}]', txt) is not None) or
+                (re.search(r'\%\{\s*(if|elif)\s+' + re.escape(var) + r'\s*\}', txt) is not None))
+        if not used:
+            for include_name in re.findall(r'\%\{\s*include\s+"(.*)"\s*\}', txt):
+                if self.uses_var(include_name, var):
+                    used = True
+                    break
+        self.used_vars[key] = used
+        return used
 
     def read_tpl(self, name):
         if name in self.cache:
@@ -122,29 +260,34 @@ class TemplateProcessor:
             self.cache[name] = f.read()
         return self.cache[name]
 
-    def build(self, tpl_name, data):
+    def compile(self, tpl_name):
+        if tpl_name in self.compiled:
+            return self.compiled[tpl_name]
         txt = self.read_tpl(tpl_name)
 
         # if there are no loops or ifs, just replace vars on the whole thing
         if '%{' not in txt:
-            return replace_vars(txt, data)
+            self.compiled[tpl_name] = txt
+            return txt
 
         lines = txt.split('\n')
         doc = DocumentElement()
+        doc.escape = self.escape
         stack = [ doc ]
         for line_num, line in enumerate(lines):
             # %{include NAME}
             match = re.fullmatch(r'\s*\%\{\s*include\s+"(.*)"\s*\}\s*', line)
             if match:
-                tpl_name = match.group(1)
-                stack[-1].add_child(IncludeElement(line_num, tpl_name, self))
+                include_name = match.group(1)
+                stack[-1].add_child(IncludeElement(line_num, include_name, self))
                 continue
             
             # %{foreach NAME}
             match = re.fullmatch(r'\s*\%\{\s*foreach\s+([a-z0-9_]+)\s*\}\s*', line)
             if match:
                 var = match.group(1)
-                el = ForeachElement(line_num, var)
+                el = ForeachElement(line_num, var, tpl_name, self)
+                el.escape = self.escape
                 stack[-1].add_child(el)
                 stack.append(el)
                 continue
@@ -154,6 +297,7 @@ class TemplateProcessor:
             if match:
                 cond = match.group(1)
                 el = IfElement(line_num, cond)
+                el.escape = self.escape
                 stack[-1].add_child(el)
                 stack.append(el)
                 continue
@@ -182,7 +326,27 @@ class TemplateProcessor:
         if len(stack) > 1:
             raise Exception("unterminated %{" + stack[-1].name + "} in line " + str(stack[-1].line+1))
 
+        self.compiled[tpl_name] = doc
+        return doc
+
+    def compile_all(self):
+        """Compile all templates in the template dir"""
+        for name in sorted(os.listdir(self.tpl_dir)):
+            if name.endswith('.tpl'):
+                self.compile(name[:-4])
+
+    def build(self, tpl_name, data):
+        doc = self.compile(tpl_name)
+        if isinstance(doc, str):
+            return replace_vars(doc, data, self.escape)
         ret = []
         doc.build(ret, data)
         return '\n'.join(ret)
-    
+
+    def build_to(self, tpl_name, data, out):
+        """Build a template writing it to a file-like object as it's built"""
+        doc = self.compile(tpl_name)
+        if isinstance(doc, str):
+            out.write(replace_vars(doc, data, self.escape))
+            return
+        doc.build(StreamCollector(out), data)
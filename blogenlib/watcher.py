@@ -0,0 +1,97 @@
+
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+class PollingWatcher:
+    """Watch directories for changes by periodically checking file mtimes"""
+
+    def __init__(self, dirs, interval=0.5):
+        self.dirs = dirs
+        self.interval = interval
+        self.mtimes = self.scan()
+
+    def scan(self):
+        ret = {}
+        for root_dir in self.dirs:
+            for dirpath, dirnames, filenames in os.walk(root_dir):
+                for name in filenames:
+                    filename = os.path.join(dirpath, name)
+                    try:
+                        ret[filename] = os.stat(filename).st_mtime
+                    except FileNotFoundError:
+                        pass
+        return ret
+
+    def get_changes(self):
+        """Return the names of the files changed since the last check, without waiting"""
+        mtimes = self.scan()
+        changed = [ name for name, mtime in mtimes.items() if self.mtimes.get(name, None) != mtime ]
+        changed.extend(name for name in self.mtimes if name not in mtimes)
+        self.mtimes = mtimes
+        return sorted(changed)
+
+    def wait(self):
+        """Wait until some files change and return their names"""
+        while True:
+            time.sleep(self.interval)
+            changed = self.get_changes()
+            if changed:
+                return changed
+
+class InotifyWatcher:
+    """Watch directories for changes using inotify"""
+
+    def __init__(self, dirs, delay=0.1):
+        self.delay = delay
+        self.inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self.mask = (flags.CREATE | flags.DELETE | flags.MODIFY | flags.CLOSE_WRITE |
+                     flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE_SELF)
+        self.watch_dirs = {}
+        for root_dir in dirs:
+            self.add_tree(root_dir)
+
+    def add_tree(self, root_dir):
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            self.add_dir(dirpath)
+
+    def add_dir(self, dirname):
+        try:
+            wd = self.inotify.add_watch(dirname, self.mask)
+        except OSError:
+            return
+        self.watch_dirs[wd] = dirname
+
+    def read_changes(self, timeout):
+        changed = set()
+        for event in self.inotify.read(timeout=timeout):
+            dirname = self.watch_dirs.get(event.wd, None)
+            if dirname is None:
+                continue
+            filename = os.path.join(dirname, event.name) if event.name else dirname
+            if (event.mask & inotify_simple.flags.ISDIR) and (event.mask & (inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO)):
+                self.add_tree(filename)
+            changed.add(filename)
+        return changed
+
+    def wait(self):
+        """Wait until some files change and return their names"""
+        changed = self.read_changes(None)
+        # editors usually write files in more than one step, so wait
+        # a bit to collect all changes
+        while True:
+            more = self.read_changes(int(self.delay * 1000))
+            if not more:
+                break
+            changed |= more
+        return sorted(changed)
+
+def make_watcher(dirs, poll=False, interval=0.5):
+    if (inotify_simple is not None) and not poll:
+        return InotifyWatcher(dirs)
+    return PollingWatcher(dirs, interval)
@@ -0,0 +1,56 @@
+
+// Client for the search index generated with "build_search = 1".
+//
+// Index shards are loaded only when a search uses terms from them:
+//
+//   var search = new BlogenSearch('/example/search');
+//   search.find('some words').then(function(posts) { ... });
+//
+// Each post found is [url, title, date].
+
+function BlogenSearch(baseUrl) {
+  this.baseUrl = baseUrl;
+  this.shards = {};
+  this.posts = null;
+}
+
+BlogenSearch.prototype.load = function(name) {
+  return fetch(this.baseUrl + '/' + name).then(function(resp) {
+    return resp.ok ? resp.json() : {};
+  });
+};
+
+BlogenSearch.prototype.getShardName = function(term) {
+  return /^[a-z0-9]/.test(term) ? term[0] : '_';
+};
+
+BlogenSearch.prototype.getShard = function(name) {
+  if (!(name in this.shards)) {
+    this.shards[name] = this.load('index-' + name + '.json');
+  }
+  return this.shards[name];
+};
+
+BlogenSearch.prototype.find = function(query) {
+  var self = this;
+  var terms = (query.toLowerCase().match(/[\p{L}\p{N}_]{2,}/gu) || []);
+  if (terms.length == 0) {
+    return Promise.resolve([]);
+  }
+  if (!this.posts) {
+    this.posts = this.load('posts.json');
+  }
+  var lookups = terms.map(function(term) {
+    return self.getShard(self.getShardName(term)).then(function(shard) {
+      return shard[term] || [];
+    });
+  });
+  return Promise.all([ this.posts ].concat(lookups)).then(function(results) {
+    var posts = results[0];
+    var ids = results[1];
+    results.slice(2).forEach(function(other) {
+      ids = ids.filter(function(id) { return other.indexOf(id) >= 0; });
+    });
+    return ids.map(function(id) { return posts[id]; });
+  });
+};
@@ -9,7 +9,7 @@
   <author>
     <name>${blog_author}</name>
   </author>
-  <generator uri="https://moefh.github.io/">BloGen<generator>
+  <generator uri="https://moefh.github.io/">BloGen</generator>
 %{foreach post}
   <entry>
     <title>${post_title}</title>
@@ -17,7 +17,7 @@
     <id>${post_url}</id>
     <published>${post_publish_time}</published>
     <updated>${post_publish_time}</updated>
-    <content type="html"><![CDATA[${post_content}]]></content>
+    <content type="html"><![CDATA[$raw{post_content}]]></content>
   </entry>
 %{end}
 </feed>
@@ -4,6 +4,9 @@
   <meta charset="utf-8">
   <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
   <link rel="alternate" href="${atom_url}" title="moefh.github.io" type="application/atom+xml">
+%{if json_feed_url}
+  <link rel="alternate" href="${json_feed_url}" title="moefh.github.io" type="application/feed+json">
+%{end}
   <link rel="stylesheet" href="${css_url}">
   <title>${blog_title}</title>
 </head>
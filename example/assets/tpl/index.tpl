@@ -8,7 +8,10 @@
 <div class="date">Posted on ${post_date}</div>
 <hr>
 
-${post_content}
+$raw{post_excerpt}
+%{if post_has_more}
+<p><a href="${post_url}">Read more...</a></p>
+%{end}
 
 <hr>
 %{foreach post_tag}
@@ -6,13 +6,20 @@
 <div class="date">Posted on ${post_date}</div>
 <hr>
 
-${post_content}
+$raw{post_content}
 
 <hr>
 %{foreach post_tag}
 <a href="${post_tag_url}">${post_tag_name}</a>
 %{end}
 
+%{if related_post}
+<p>Related posts:</p>
+%{foreach related_post}
+<p><a href="${related_post_url}">${related_post_title}</a></p>
+%{end}
+%{end}
+
 </div>
 
 %{include "footer"}
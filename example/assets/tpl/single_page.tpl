@@ -2,6 +2,6 @@
 
 <h1>${page_title}</h1>
 
-${page_content}
+$raw{page_content}
 
 %{include "footer"}
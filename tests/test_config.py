@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+
+from blogenlib.config import (Config, ConfigError, parse_bool, parse_count, parse_dir, parse_highlighter,
+                              parse_int, parse_non_negative, parse_path, parse_site_url, parse_str, parse_url_path)
+
+class ParseTest(unittest.TestCase):
+
+    def test_str(self):
+        self.assertEqual(parse_str('k', 'value'), 'value')
+        with self.assertRaises(ConfigError):
+            parse_str('k', [ 'a', 'b' ])
+
+    def test_int(self):
+        self.assertEqual(parse_int('k', '42'), 42)
+        self.assertEqual(parse_int('k', '-1'), -1)
+        with self.assertRaises(ConfigError):
+            parse_int('k', 'ten')
+
+    def test_count(self):
+        self.assertEqual(parse_count('k', '1'), 1)
+        for val in ('0', '-3', 'x'):
+            with self.assertRaises(ConfigError):
+                parse_count('k', val)
+
+    def test_non_negative(self):
+        self.assertEqual(parse_non_negative('k', '0'), 0)
+        self.assertEqual(parse_non_negative('k', '7'), 7)
+        with self.assertRaises(ConfigError):
+            parse_non_negative('k', '-1')
+
+    def test_bool(self):
+        for val in ('', '0', 'no', 'false', 'off', 'No', 'FALSE'):
+            self.assertIs(parse_bool('k', val), False, val)
+        for val in ('1', 'yes', 'true', 'on', 'Yes', 'TRUE'):
+            self.assertIs(parse_bool('k', val), True, val)
+        with self.assertRaisesRegex(ConfigError, "'k' must be"):
+            parse_bool('k', '2')
+
+    def test_path(self):
+        self.assertEqual(parse_path('k', ''), '')
+        self.assertEqual(parse_path('k', 'a/b'), os.path.abspath('a/b'))
+
+    def test_dir(self):
+        self.assertEqual(parse_dir('k', '/tmp'), '/tmp')
+        with self.assertRaisesRegex(ConfigError, "'k' must be set"):
+            parse_dir('k', '')
+
+    def test_site_url(self):
+        self.assertEqual(parse_site_url('k', ''), '')
+        self.assertEqual(parse_site_url('k', 'https://example.com/'), 'https://example.com')
+        with self.assertRaises(ConfigError):
+            parse_site_url('k', 'example.com')
+
+    def test_url_path(self):
+        self.assertEqual(parse_url_path('k', ''), '')
+        self.assertEqual(parse_url_path('k', '/'), '/')
+        self.assertEqual(parse_url_path('k', '/blog/'), '/blog')
+        self.assertEqual(parse_url_path('k', 'blog/'), 'blog')
+
+    def test_highlighter(self):
+        self.assertEqual(parse_highlighter('k', ''), '')
+        self.assertEqual(parse_highlighter('k', '0'), '')
+        self.assertEqual(parse_highlighter('k', '1'), 'builtin')
+        self.assertEqual(parse_highlighter('k', 'builtin'), 'builtin')
+        self.assertEqual(parse_highlighter('k', 'pygments'), 'pygments')
+        with self.assertRaises(ConfigError):
+            parse_highlighter('k', 'rouge')
+
+class ConfigTest(unittest.TestCase):
+
+    def make_config(self, text):
+        fd, filename = tempfile.mkstemp(suffix='.cfg')
+        self.addCleanup(os.remove, filename)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        return Config(filename)
+
+    def test_snapshot(self):
+        config = self.make_config('\n'.join([
+            '# comment',
+            'source_dir  = /src',
+            'assets_dir  = /assets',
+            'publish_dir = /out',
+            'publish_url = /blog/',
+            'build_tags  = yes',
+            'posts_in_index_page = 3',
+            'plugin_list[] = a',
+            'plugin_list[] = b',
+        ]))
+        snapshot = config.snapshot()
+        self.assertEqual(snapshot.source_dir, '/src')
+        self.assertEqual(snapshot.publish_url, '/blog')
+        self.assertEqual(snapshot.publish_url_prefix, '/blog/')
+        self.assertIs(snapshot.build_tags, True)
+        self.assertIs(snapshot.build_atom, False)
+        self.assertEqual(snapshot.posts_in_index_page, 3)
+        self.assertEqual(snapshot.posts_in_tag_page, 5)
+        self.assertEqual(config.v.plugin_list, [ 'a', 'b' ])
+        self.assertIsNone(config.v.missing)
+
+    def test_snapshot_errors(self):
+        config = self.make_config('source_dir = /src\nposts_in_tag_page = 0\n')
+        with self.assertRaises(ConfigError) as cm:
+            config.snapshot()
+        message = str(cm.exception)
+        self.assertIn("'assets_dir' must be set", message)
+        self.assertIn("'publish_dir' must be set", message)
+        self.assertIn("'posts_in_tag_page' must be at least 1", message)
+
+    def test_set_resets_snapshot(self):
+        config = self.make_config('source_dir = /src\nassets_dir = /assets\npublish_dir = /out\n')
+        self.assertIs(config.snapshot().build_search, False)
+        config.set('build_search', '1')
+        self.assertIs(config.snapshot().build_search, True)
+
+    def test_warnings(self):
+        config = self.make_config('buld_tags = 1\nmy_plugin_option = 1\n')
+        self.assertEqual(len(config.get_warnings()), 1)
+        self.assertIn("did you mean 'build_tags'", config.get_warnings()[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import time
+import unittest
+
+from blogenlib.minify import minify_html
+
+class MinifyTest(unittest.TestCase):
+
+    def test_whitespace(self):
+        self.assertEqual(minify_html('<p>a    b\t c</p>'), '<p>a b c</p>')
+        self.assertEqual(minify_html('<ul>\n    <li>a</li>\n\n    <li>b</li>\n</ul>\n'),
+                         '<ul>\n<li>a</li>\n<li>b</li>\n</ul>\n')
+
+    def test_tags(self):
+        self.assertEqual(minify_html('<a   href="x"\n    title="a  b">'), '<a href="x"\ntitle="a  b">')
+        self.assertEqual(minify_html("<img alt='a > b'   src=x>"), "<img alt='a > b' src=x>")
+
+    def test_raw_elements(self):
+        for html in ('<pre>  a\n    b</pre>', '<textarea>  x  </textarea>',
+                     '<script>if (a  <  b) {}</script>', '<STYLE>p  { }</style >'):
+            self.assertEqual(minify_html('<div>  ' + html + '  </div>'), '<div> ' + html + ' </div>')
+
+    def test_unclosed(self):
+        self.assertEqual(minify_html('a   b <pre>  x  '), 'a b <pre>  x  ')
+        self.assertEqual(minify_html('a   b <p title="x  '), 'a b <p title="x  ')
+
+    def test_not_tags(self):
+        self.assertEqual(minify_html('1  < 2  <3'), '1 < 2 <3')
+
+    def test_unclosed_is_fast(self):
+        html = '<p a="' + ' <p x' * 20000
+        start = time.perf_counter()
+        self.assertEqual(minify_html(html), html)
+        self.assertLess(time.perf_counter() - start, 1)
+
+if __name__ == '__main__':
+    unittest.main()
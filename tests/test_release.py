@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+from blogenlib.release import Releases, link_tree
+
+def write_file(filename, text):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        f.write(text)
+
+def read_file(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+class LinkTreeTest(unittest.TestCase):
+
+    def test_link_tree(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'src')
+            dest = os.path.join(tmp, 'dest')
+            write_file(os.path.join(src, 'a', 'index.html'), 'page')
+            write_file(os.path.join(src, '.state'), 'state')
+            link_tree(src, dest)
+            self.assertTrue(os.path.samefile(os.path.join(src, 'a', 'index.html'), os.path.join(dest, 'a', 'index.html')))
+            self.assertFalse(os.path.samefile(os.path.join(src, '.state'), os.path.join(dest, '.state')))
+            self.assertEqual(read_file(os.path.join(dest, '.state')), 'state')
+
+class ReleasesTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.publish_dir = os.path.join(tmp.name, 'public')
+        self.releases_dir = os.path.join(tmp.name, 'releases')
+
+    def build(self, releases, text):
+        release_dir = releases.stage()
+        # files are replaced, not written over, like the builder does
+        filename = os.path.join(release_dir, 'index.html')
+        if os.path.exists(filename):
+            os.remove(filename)
+        write_file(filename, text)
+        releases.activate(release_dir)
+        return release_dir
+
+    def test_first_release_from_publish_dir(self):
+        write_file(os.path.join(self.publish_dir, 'index.html'), 'old')
+        releases = Releases(self.publish_dir, self.releases_dir, 3)
+        self.assertIsNone(releases.get_current())
+        release_dir = releases.stage()
+        self.assertTrue(os.path.islink(self.publish_dir))
+        self.assertEqual(len(releases.get_release_list()), 2)
+        self.assertEqual(read_file(os.path.join(release_dir, 'index.html')), 'old')
+        self.assertNotEqual(releases.get_current(), os.path.realpath(release_dir))
+
+    def test_activate_and_discard(self):
+        releases = Releases(self.publish_dir, self.releases_dir, 3)
+        first = self.build(releases, 'one')
+        self.assertEqual(releases.get_current(), os.path.realpath(first))
+        failed = releases.stage()
+        releases.discard(failed)
+        self.assertFalse(os.path.exists(failed))
+        self.assertEqual(read_file(os.path.join(self.publish_dir, 'index.html')), 'one')
+
+    def test_prune(self):
+        releases = Releases(self.publish_dir, self.releases_dir, 2)
+        built = [ self.build(releases, str(i)) for i in range(4) ]
+        self.assertEqual(releases.prune(), built[:2])
+        self.assertEqual(releases.get_release_list(), built[2:])
+        self.assertEqual(read_file(os.path.join(self.publish_dir, 'index.html')), '3')
+        self.assertEqual(read_file(os.path.join(built[2], 'index.html')), '2')
+
+    def test_prune_keeps_current(self):
+        releases = Releases(self.publish_dir, self.releases_dir, 1)
+        built = [ self.build(releases, str(i)) for i in range(3) ]
+        # roll back to an old release
+        releases.activate(built[0])
+        self.assertEqual(releases.prune(), built[1:2])
+        self.assertEqual(releases.get_release_list(), [ built[0], built[2] ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import unittest
+
+from blogenlib.search import SearchIndex, extract_terms, get_shard_name
+
+class StubPost:
+
+    def __init__(self, name, title, text, tags=()):
+        self.name = name
+        self.title = title
+        self.text = text
+        self.tags = list(tags)
+
+    def get_name(self):
+        return self.name
+
+    def get_title(self):
+        return self.title
+
+    def get_tags(self):
+        return self.tags
+
+    def get_text(self):
+        return self.text
+
+    def get_date(self):
+        return '2021-05-24'
+
+def post_url(post):
+    return '/' + post.get_name() + '/'
+
+def get_html(post):
+    return '<p>' + post.get_text() + '</p>'
+
+class TermsTest(unittest.TestCase):
+
+    def test_extract_terms(self):
+        self.assertEqual(extract_terms('<p class="x">Hello&amp; <b>hello</b> World a 42</p>'),
+                         [ '42', 'hello', 'world' ])
+
+    def test_shard_name(self):
+        self.assertEqual(get_shard_name('hello'), 'h')
+        self.assertEqual(get_shard_name('42'), '4')
+        self.assertEqual(get_shard_name('éclair'), '_')
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.posts = [
+            StubPost('first', 'First Post', 'apples and oranges', [ 'fruit' ]),
+            StubPost('second', 'Second Post', 'oranges and bananas'),
+            StubPost('third', 'Third Post', 'just bananas'),
+        ]
+
+    def build(self, posts, old_terms=None):
+        index = SearchIndex(None, old_terms=old_terms)
+        for post in posts:
+            index.add_post(post, get_html)
+        return index
+
+    def test_files(self):
+        files = self.build(self.posts).get_files(self.posts, post_url)
+        self.assertEqual(json.loads(files['posts.json'])[1], [ '/second/', 'Second Post', '2021-05-24' ])
+        self.assertEqual(json.loads(files['index-o.json'])['oranges'], [ 0, 1 ])
+        self.assertEqual(json.loads(files['index-b.json'])['bananas'], [ 1, 2 ])
+        self.assertEqual(json.loads(files['index-f.json'])['fruit'], [ 0 ])
+        self.assertEqual(json.loads(files['shards.json']), sorted(name[6:-5] for name in files if name.startswith('index-')))
+
+    def test_shard_merge(self):
+        # each shard indexes some of the posts, then the terms are merged
+        shards = [ self.build(self.posts[:2]), self.build(self.posts[2:]) ]
+        merged = SearchIndex(None, old_terms={})
+        for shard in shards:
+            merged.add_terms(shard.terms)
+        self.assertEqual(merged.get_files(self.posts, post_url), self.build(self.posts).get_files(self.posts, post_url))
+
+    def test_unchanged_posts_are_reused(self):
+        old_terms = self.build(self.posts).terms
+        changed = StubPost('second', 'Second Post', 'only kiwis')
+        rendered = []
+        def get_html_once(post):
+            rendered.append(post.get_name())
+            return get_html(post)
+        index = SearchIndex(None, old_terms=old_terms)
+        for post in [ self.posts[0], changed, self.posts[2] ]:
+            index.add_post(post, get_html_once)
+        self.assertEqual(rendered, [ 'second' ])
+        self.assertIn('kiwis', index.terms['second']['terms'])
+        self.assertNotIn('oranges', index.terms['second']['terms'])
+
+    def test_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_filename = os.path.join(tmp, 'search', 'state.json')
+            index = SearchIndex(state_filename)
+            self.assertEqual(index.old_terms, {})
+            for post in self.posts:
+                index.add_post(post, get_html)
+            index.write_state()
+            self.assertEqual(SearchIndex(state_filename).old_terms, index.terms)
+
+if __name__ == '__main__':
+    unittest.main()